@@ -0,0 +1,288 @@
+# benchmarks/hot_path.py
+"""
+End-to-end benchmark of the message -> translation -> reply hot path.
+Synthetic Telegram updates are replayed through the real bot.handle_group_message handler,
+with a fake bot that records sends and the local FakeBackend standing in for the translator.
+
+Usage:
+    python -m benchmarks.hot_path --groups 20 --languages 4 --message-size 80 --rate 50 --messages 1000
+
+Reports p50/p95/p99 latency from update arrival to the translation reply, messages per second,
+translator calls per message and database queries per message, and writes them as JSON to --output.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = (
+    "hello everyone the meeting is moved to tomorrow morning please bring your notes "
+    "thanks good night see you soon where are we going for dinner tonight"
+).split()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the group message hot path.")
+    parser.add_argument("--groups", type=int, default=10, help="Number of groups")
+    parser.add_argument("--languages", type=int, default=3, help="Target languages per group")
+    parser.add_argument("--members", type=int, default=5, help="Members per group")
+    parser.add_argument("--message-size", type=int, default=60, help="Approximate message length in characters")
+    parser.add_argument("--rate", type=float, default=20.0, help="Message arrival rate per second, across all groups")
+    parser.add_argument("--messages", type=int, default=500, help="Number of messages to replay")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="Share of messages repeating an earlier text")
+    parser.add_argument("--backend-latency-ms", type=float, default=200.0, help="Simulated translator latency")
+    parser.add_argument("--backend-jitter-ms", type=float, default=50.0, help="Simulated translator latency jitter")
+    parser.add_argument("--backend-failure-rate", type=float, default=0.0, help="Share of failing translator calls")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for load generation and the fake backend")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to wait for outstanding replies")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    return parser.parse_args(argv)
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def configure_environment(args):
+    # Must happen before the bot and services are imported, since they read configuration at import time
+    directory = tempfile.mkdtemp(prefix="bench-")
+    os.environ["DATABASE_PATH"] = os.path.join(directory, "bench.db")
+    os.environ["OUTBOX_PATH"] = os.path.join(directory, "outbox.db")
+    os.environ["TRANSLATION_BACKEND"] = "fake"
+    os.environ["FAKE_BACKEND_LATENCY_MS"] = str(args.backend_latency_ms)
+    os.environ["FAKE_BACKEND_JITTER_MS"] = str(args.backend_jitter_ms)
+    os.environ["FAKE_BACKEND_FAILURE_RATE"] = str(args.backend_failure_rate)
+    os.environ["FAKE_BACKEND_SEED"] = str(args.seed)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+    # The fake bot has no Telegram rate limits; set these to measure pacing by the send scheduler
+    os.environ.setdefault("SEND_GLOBAL_RATE", "0")
+    os.environ.setdefault("SEND_CHAT_RATE", "0")
+    os.environ.setdefault("SEND_GROUP_RATE_PER_MINUTE", "0")
+
+class FakeBot:
+    """
+    Stands in for telegram.Bot: records every send instead of calling the Bot API.
+    """
+
+    def __init__(self):
+        from telegram import User
+        self.user = User(id=1, first_name="LiveTranslatorBot", is_bot=True)
+        self.sent = []
+        self._next_message_id = 10_000_000
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None, **kwargs):
+        from telegram import Chat, Message
+        self.sent.append((time.perf_counter(), chat_id, reply_to_message_id, text))
+        self._next_message_id += 1
+        message = Message(
+            message_id=self._next_message_id,
+            date=datetime.datetime.now(datetime.timezone.utc),
+            chat=Chat(id=int(chat_id), type=Chat.SUPERGROUP),
+            from_user=self.user,
+            text=text,
+        )
+        message.set_bot(self)
+        return message
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.sent.append((time.perf_counter(), chat_id, None, text))
+        return True
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+
+def make_message_text(rng: random.Random, size: int) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).capitalize() + "."
+
+def setup_groups(args, rng: random.Random) -> dict:
+    from services.translator import LANGUAGE_CODES
+    from services.users_lang_manager import set_user_language, load_language_index
+
+    # Messages are generated in English, which would be skipped as a same-language target
+    codes = sorted(code for code in LANGUAGE_CODES.values() if code != "en")
+    groups = {}
+    for group_index in range(args.groups):
+        group_id = -1_000_000 - group_index
+        languages = rng.sample(codes, min(args.languages, len(codes)))
+        members = []
+        for member_index in range(args.members):
+            user_id = group_index * 1000 + member_index + 1
+            set_user_language(str(group_id), str(user_id), f"user{user_id}", languages[member_index % len(languages)])
+            members.append(user_id)
+        groups[group_id] = members
+    load_language_index()
+    return groups
+
+def build_updates(args, rng: random.Random, groups: dict, bot) -> list:
+    from telegram import Chat, Message, Update, User
+
+    updates = []
+    texts = []
+    group_ids = list(groups)
+    for index in range(args.messages):
+        group_id = rng.choice(group_ids)
+        user_id = rng.choice(groups[group_id])
+        if texts and rng.random() < args.repeat_ratio:
+            text = rng.choice(texts)
+        else:
+            text = make_message_text(rng, args.message_size)
+            texts.append(text)
+        message = Message(
+            message_id=index + 1,
+            date=datetime.datetime.now(datetime.timezone.utc),
+            chat=Chat(id=group_id, type=Chat.SUPERGROUP),
+            from_user=User(id=user_id, first_name=f"user{user_id}", is_bot=False),
+            text=text,
+        )
+        message.set_bot(bot)
+        updates.append(Update(update_id=index + 1, message=message))
+    return updates
+
+async def replay(args, updates: list, bot, handler) -> dict:
+    context = FakeContext(bot)
+    arrivals = {}
+    handler_latencies = []
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    start = time.perf_counter()
+
+    for index, update in enumerate(updates):
+        delay = start + index * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        message = update.message
+        arrived = time.perf_counter()
+        arrivals[(message.chat.id, message.message_id)] = arrived
+        await handler(update, context)
+        handler_latencies.append(time.perf_counter() - arrived)
+
+    # Wait for the group workers to send every reply
+    deadline = time.perf_counter() + args.drain_timeout
+    while time.perf_counter() < deadline:
+        replied = {(chat_id, reply_to) for _, chat_id, reply_to, _ in bot.sent if reply_to is not None}
+        if len(replied) >= len(arrivals):
+            break
+        await asyncio.sleep(0.01)
+
+    latencies = []
+    replied_at = {}
+    for sent_at, chat_id, reply_to, _ in bot.sent:
+        key = (int(chat_id), reply_to)
+        if key in arrivals and key not in replied_at:
+            replied_at[key] = sent_at
+            latencies.append(sent_at - arrivals[key])
+    end = max(replied_at.values(), default=time.perf_counter())
+    return {
+        "latencies": sorted(latencies),
+        "handler_latencies": sorted(handler_latencies),
+        "elapsed": end - start,
+        "unanswered": len(arrivals) - len(replied_at),
+    }
+
+def summarize(args, outcome: dict, backend_calls: int, db_queries: int) -> dict:
+    latencies = outcome["latencies"]
+    handler_latencies = outcome["handler_latencies"]
+    answered = len(latencies)
+    return {
+        "messages": args.messages,
+        "answered": answered,
+        "unanswered": outcome["unanswered"],
+        "elapsed_s": round(outcome["elapsed"], 4),
+        "messages_per_s": round(answered / outcome["elapsed"], 2) if outcome["elapsed"] > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "handler_latency_ms": {
+            "p50": round(percentile(handler_latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(handler_latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(handler_latencies, 0.99) * 1000, 3),
+        },
+        "translator_calls": backend_calls,
+        "translator_calls_per_message": round(backend_calls / args.messages, 3) if args.messages else 0.0,
+        "db_queries": db_queries,
+        "db_queries_per_message": round(db_queries / args.messages, 3) if args.messages else 0.0,
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from database import models
+    from database.models import init_db
+
+    db_queries = 0
+
+    def count_query(statement):
+        nonlocal db_queries
+        if not statement.startswith("PRAGMA"):
+            db_queries += 1
+
+    connect = models._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(count_query)
+        return conn
+
+    models._connect = traced_connect
+
+    import bot as bot_module
+    from services.translator import get_backend
+
+    init_db()
+    rng = random.Random(args.seed)
+    groups = setup_groups(args, rng)
+    fake_bot = FakeBot()
+    updates = build_updates(args, rng, groups, fake_bot)
+
+    backend = get_backend()
+    backend_calls_before = backend.calls
+    db_queries = 0
+    outcome = asyncio.run(replay(args, updates, fake_bot, bot_module.handle_group_message))
+
+    results = summarize(args, outcome, backend.calls - backend_calls_before, db_queries)
+    report = {
+        "benchmark": "hot_path",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = results["latency_ms"]
+    print(
+        f"{results['answered']}/{results['messages']} answered in {results['elapsed_s']}s "
+        f"({results['messages_per_s']} msg/s)\n"
+        f"latency p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms\n"
+        f"translator calls/msg={results['translator_calls_per_message']} "
+        f"db queries/msg={results['db_queries_per_message']}\n"
+        f"results written to {args.output}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -7,37 +7,77 @@ The bot supports a help command and broadcasts setup instructions when joining a
 """
 
 import os
-import asyncio
+import re
+import time
 from dotenv import load_dotenv
-from telegram import Update, ChatMemberUpdated
+from telegram import Update, ChatMember, ChatMemberUpdated, Message
+from telegram.constants import ChatMemberStatus
 from telegram.ext import (
     ApplicationBuilder,
     MessageHandler,
     ContextTypes,
     filters,
     ChatMemberHandler,
+    TypeHandler,
 )
 
-import nest_asyncio
-nest_asyncio.apply()
-
-from database.models import init_db
-from services.users_lang_manager import set_user_language, get_user_language, get_all_languages
-from services.translator import translate_to_multiple_languages, validate_language, InvalidLanguageException
+from database.models import init_db, run_db
+from services.users_lang_manager import (
+    set_user_language, get_user_language, get_all_languages, get_members_by_language, load_language_index,
+    get_language_counts, record_activity_async, remove_member, flush_activity, maintain_members,
+)
+from telegram.error import BadRequest
+from services.translator import format_translations, validate_language, InvalidLanguageException, LANGUAGE_NAMES
+from services.message_queue import submit_message, QueueFullError
+from services.admission import admission
+from services.message_edits import (
+    remember_translation, retranslate_edit, get_translation_record, mark_pending, hold_edit, finish_pending,
+)
+from services.language_detection import detect_language
+from services.message_filter import untranslatable_reason, mask_spans
+from services.segmentation import split_segments
+from services.delivery import DELIVERY_MODE, deliver_translations
+from services.send_scheduler import send_scheduler, PRIORITY_TRANSLATION, PRIORITY_REPLY, PRIORITY_BACKGROUND, MESSAGE_LIMIT
+from services import metrics
+from services.sharding import BOT_WORKERS, ShardRouter, owns_chat, is_router
+from services.outbox import outbox
+from services.system_messages import system_messages, telegram_language
 
 # Load Telegram bot token from environment
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-# Help message explaining the bot's functionality
-HELP_MESSAGE = """
-Bot Usage Guide:
+# How updates are received: polling (long polling) or webhook (Telegram pushes updates to an HTTP listener)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Number of updates processed at the same time; 1 processes them one by one
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
 
-- To set your preferred language, simply send the language name (e.g., English, Español, עברית).
-- The bot will translate each message in the group to all preferred languages.
-- You can change your language preference at any time by sending a new language name.
-- Use the command 'bot help' to see this help message again.
-"""
+# Webhook settings, used when BOT_MODE is webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS URL Telegram posts updates to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Checked against the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+_SECRET_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+TRANSLATIONS_HEADER = "🌍 Translations: 🌍\n"
+
+metrics.describe("message_latency_seconds", "Time from receiving a group message to sending its translations")
+metrics.describe("message_first_reply_seconds", "Time from receiving a group message to its first translation reply")
+metrics.describe("edits_skipped_total", "Edits not applied because the message's translations cannot be edited in place")
+
+def message_languages(group_id: str, user=None) -> list:
+    """
+    Languages the bot's own messages are shown in, besides English: the group's languages,
+    and the Telegram app language of the user being answered.
+    """
+    languages = list(get_all_languages(group_id))
+    user_language = telegram_language(user.language_code) if user is not None else None
+    if user_language is not None and user_language not in languages:
+        languages.append(user_language)
+    return languages
 
 async def initialize_group_if_needed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -45,12 +85,13 @@ async def initialize_group_if_needed(update: Update, context: ContextTypes.DEFAU
     If no preferences exist, broadcasts a message prompting users to set their language.
     """
     group_id = str(update.effective_chat.id)
-    target_languages = get_all_languages(group_id)
 
-    if not target_languages:
-        await context.bot.send_message(
+    # Languages of inactive members are still preferences: only an empty group is set up again
+    if not get_language_counts(group_id):
+        await send_scheduler.send(
+            group_id, context.bot.send_message, PRIORITY_BACKGROUND, kind="setup",
             chat_id=group_id,
-            text="Language setup initiated. Each user, please send your preferred language (e.g., English, Español, עברית).\nSend 'bot help' to view instructions."
+            text=system_messages.render("setup", message_languages(group_id, update.effective_user)),
         )
 
 async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -60,15 +101,18 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
     - Detects if the message is a language name and updates the user's preference.
     - Otherwise, translates the message to all preferred group languages.
     """
+    received_at = time.perf_counter()
     msg = update.message
     group_id = str(msg.chat.id)
     user_id = str(msg.from_user.id)
     user_name = msg.from_user.full_name
     text = msg.text.strip().lower()
+    # Keeps the sender's language among the group's targets
+    await record_activity_async(group_id, user_id)
 
     # Respond to help command
     if text == "bot help":
-        await msg.reply_text(HELP_MESSAGE)
+        await send_scheduler.send(group_id, msg.reply_text, PRIORITY_REPLY, text=system_messages.render("help", message_languages(group_id, msg.from_user)))
         return
 
     # Detect if message is a valid language name
@@ -76,65 +120,396 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
         text = text.replace("change language:", "").strip()
         try:
             if not text:
-                await msg.reply_text("Please provide a valid language name.")
+                await send_scheduler.send(
+                    group_id, msg.reply_text, PRIORITY_REPLY,
+                    text=system_messages.render("empty_language", message_languages(group_id, msg.from_user)),
+                )
                 return
             lang_code = validate_language(text)
-            set_user_language(group_id, user_id, user_name, lang_code)
-            await msg.reply_text(f"Language preference for {user_name} set to '{text}'.\nYou can change it anytime by sending 'change language: <language>'.")
+            await run_db(set_user_language, group_id, user_id, user_name, lang_code)
+            await send_scheduler.send(
+                group_id, msg.reply_text, PRIORITY_REPLY,
+                text=system_messages.render("language_set", message_languages(group_id, msg.from_user), user_name=user_name, language=LANGUAGE_NAMES.get(lang_code, lang_code)),
+            )
             return
-        except InvalidLanguageException:
-            await msg.reply_text(f"Invalid language '{text}'. Please send a valid language name.\nIf you need help, type 'bot help.")
+        except InvalidLanguageException as e:
+            languages = message_languages(group_id, msg.from_user)
+            if e.suggestions:
+                reply = system_messages.render("invalid_language_suggestions", languages, language=text, suggestions=", ".join(e.suggestions))
+            else:
+                reply = system_messages.render("invalid_language", languages, language=text)
+            await send_scheduler.send(group_id, msg.reply_text, PRIORITY_REPLY, text=reply)
             return
 
-    # Check if there are target languages in the group
+    # Check if there are language preferences in the group
+    if not get_language_counts(group_id):
+        await send_scheduler.send(
+            group_id, msg.reply_text, PRIORITY_REPLY,
+            text=system_messages.render("no_languages", message_languages(group_id, msg.from_user)),
+        )
+        await initialize_group_if_needed(update, context)
+        return
+    # Only the languages of active members are translated
     target_languages = get_all_languages(group_id)
     if not target_languages:
-        await msg.reply_text("No language preferences found in this group. Please send your preferred language.")
-        await initialize_group_if_needed(update, context)
         return
 
-    # Translate the message to all preferred languages
-    translated_text = translate_to_multiple_languages(msg.text, target_languages)
+    await queue_translation(msg, group_id, user_id, target_languages, received_at)
+
+def split_reply(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """
+    Splits a reply into pages Telegram accepts, at line breaks where possible and between
+    sentences or words otherwise. Pages are filled greedily, so appending text only ever changes
+    the last page or adds new ones.
+    Args:
+        text (str): The reply text.
+        limit (int): Longest page allowed.
+    Returns:
+        list[str]: The pages, in order.
+    """
+    pages = []
+    current = ""
+    for line_number, line in enumerate(text.split("\n")):
+        separator = "\n" if line_number and current else ""
+        while len(current) + len(separator) + len(line) > limit:
+            # The line's head fills what is left of the page, so no page is cut short (e.g. a lone header)
+            room = limit - len(current) - len(separator)
+            head = ""
+            for segment in split_segments(line, max(1, room)):
+                if len(head) + len(segment) > room:
+                    break
+                head += segment
+            # Only a page of its own may cut inside a word
+            if current and not head[-1:].isspace():
+                head = ""
+            if head:
+                current += separator + head
+                line = line[len(head):]
+            pages.append(current.rstrip())
+            current, separator = "", ""
+        current += separator + line
+    pages.append(current.rstrip())
+    return pages
+
+async def queue_translation(msg, group_id: str, user_id: str, target_languages: list, received_at: float, outbox_entry: str | None = None):
+    """
+    Hands a message to its group's worker, which batches it with the rest of the burst,
+    translates it and replies in order.
+    Translations of long messages arrive language by language: the reply is posted with the first
+    finished languages and edited as the others complete.
+    With DELIVERY_MODE topics or direct, each language goes only to the members reading it instead.
+    The message is kept in the outbox until its translations are sent, so a restart does not lose it;
+    `outbox_entry` is its existing entry when it is replayed after a restart.
+    Edits made before the message is answered are held and applied to its reply afterwards.
+    """
+    if outbox_entry is None:
+        outbox_entry = outbox.append(group_id, msg.to_dict())
+    mark_pending(group_id, msg.message_id)
+
+    # Reply messages sent so far, with the text each one currently shows
+    pages = []
 
-    await msg.reply_text(f"🌍 Translations: 🌍\n{translated_text}", reply_to_message_id=msg.message_id)
+    async def show(results: dict, kind: str):
+        texts = split_reply(TRANSLATIONS_HEADER + format_translations(results))
+        for index, text in enumerate(texts):
+            if index < len(pages):
+                if pages[index][1] == text:
+                    continue
+                await send_scheduler.send(
+                    group_id, msg.get_bot().edit_message_text, PRIORITY_TRANSLATION,
+                    coalesce_key=("edit", pages[index][0].message_id), kind="edit",
+                    chat_id=group_id, message_id=pages[index][0].message_id, text=text,
+                )
+                pages[index] = (pages[index][0], text)
+            else:
+                reply = await send_scheduler.send(
+                    group_id, msg.reply_text, PRIORITY_TRANSLATION, kind=kind, text=text, reply_to_message_id=msg.message_id,
+                )
+                pages.append((reply, text))
+                if len(pages) == 1:
+                    metrics.observe("message_first_reply_seconds", time.perf_counter() - received_at)
+
+    # Languages already delivered per recipient, when DELIVERY_MODE is not group
+    delivered = set()
+
+    async def deliver(results: dict) -> bool:
+        new_results = {lang_code: result for lang_code, result in results.items() if lang_code not in delivered}
+        # Loading a group's members reads the database, so it stays off the event loop
+        members_by_language = await run_db(get_members_by_language, group_id) if DELIVERY_MODE == "direct" else {}
+        if not await deliver_translations(
+            msg.get_bot(), group_id, msg.chat.title or group_id, msg.from_user.full_name,
+            new_results, members_by_language,
+        ):
+            return False
+        if not delivered and new_results:
+            metrics.observe("message_first_reply_seconds", time.perf_counter() - received_at)
+        delivered.update(new_results)
+        return True
+
+    async def send_progress(results: dict):
+        if DELIVERY_MODE != "group" and await deliver(results):
+            return
+        await show(results, "progress")
+
+    async def finish(reply_message_id: int | None, results: dict | None):
+        outbox.complete(outbox_entry)
+        # Remembered for later edits; None as the reply when the translations cannot be edited in place
+        if results is not None:
+            remember_translation(group_id, msg.message_id, reply_message_id, msg.text, results)
+        edited = finish_pending(group_id, msg.message_id)
+        if edited is not None:
+            await apply_edit(edited, time.perf_counter())
+
+    async def send_translations(results: dict):
+        # Nothing to send when the message is already in every target language
+        if not results:
+            await finish(None, None)
+            return
+        if DELIVERY_MODE != "group" and await deliver(results):
+            metrics.observe("message_latency_seconds", time.perf_counter() - received_at)
+            await finish(None, results)
+            return
+        await show(results, "translation")
+        metrics.observe("message_latency_seconds", time.perf_counter() - received_at)
+        # Only single-message replies can be edited in place when the message is edited
+        await finish(pages[0][0].message_id if len(pages) == 1 else None, results)
+
+    def dropped():
+        # Merged into another message or dropped unanswered: an edit held meanwhile has no reply to go to
+        outbox.complete(outbox_entry)
+        finish_pending(group_id, msg.message_id)
+
+    try:
+        # When merged into the sender's previous message, the entry is completed once that message is answered
+        submit_message(
+            group_id, user_id, msg.text, target_languages, send_translations, send_progress,
+            on_dropped=dropped,
+        )
+    except QueueFullError:
+        outbox.complete(outbox_entry)
+        finish_pending(group_id, msg.message_id)
+        # One notice per group at a time, so refusing messages does not add a reply for each of them
+        if not admission.should_notify(group_id):
+            return
+        await send_scheduler.send(
+            group_id, msg.reply_text, PRIORITY_REPLY,
+            text=system_messages.render("queue_full", message_languages(group_id, msg.from_user)),
+        )
+
+async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles edits of group messages.
+    """
+    await apply_edit(update.edited_message, time.perf_counter())
+
+async def apply_edit(msg, received_at: float):
+    """
+    Applies an edit of a group message to its translations.
+    Retranslates only the sentences that changed and edits the existing translation reply in place.
+    The edit of a message not answered yet is held until its reply exists; messages answered per recipient
+    or over several replies are not sent again. Messages whose translation is not known (too old) are
+    translated as new.
+    """
+    group_id = str(msg.chat.id)
+    user_id = str(msg.from_user.id)
+
+    if hold_edit(group_id, msg.message_id, msg):
+        return
+    record = get_translation_record(group_id, msg.message_id)
+    if record is not None and record["reply_message_id"] is None:
+        metrics.increment("edits_skipped_total")
+        return
+
+    target_languages = get_all_languages(group_id)
+    if not target_languages:
+        return
+
+    # Same pre-filter as new messages: nothing to translate, nothing to redo
+    reason = untranslatable_reason(msg.text)
+    if reason is not None:
+        metrics.increment("translator_targets_skipped_total", len(target_languages), reason=reason)
+        return
+    source = detect_language(mask_spans(msg.text)[0])
+    languages = [lang_code for lang_code in target_languages if lang_code != source]
+    reply_message_id, results = await retranslate_edit(group_id, msg.message_id, msg.text, languages, source or "auto")
+    if reply_message_id is None:
+        await queue_translation(msg, group_id, user_id, target_languages, received_at)
+        return
+    if not results:
+        return
+
+    texts = split_reply(TRANSLATIONS_HEADER + format_translations(results))
+    try:
+        await send_scheduler.send(
+            group_id, msg.get_bot().edit_message_text, PRIORITY_TRANSLATION,
+            coalesce_key=("edit", reply_message_id), kind="edit",
+            chat_id=group_id,
+            message_id=reply_message_id,
+            text=texts[0],
+        )
+    except BadRequest as e:
+        # Raised when the edit did not change the translations
+        if "not modified" not in str(e).lower():
+            raise
+    # The edit made the translations too long for one message
+    for text in texts[1:]:
+        await send_scheduler.send(
+            group_id, msg.reply_text, PRIORITY_TRANSLATION, kind="translation", text=text, reply_to_message_id=msg.message_id,
+        )
+
+def is_chat_member(chat_member: ChatMember) -> bool:
+    """
+    Tells whether a chat member status means the user is in the chat.
+    """
+    if chat_member.status == ChatMemberStatus.RESTRICTED:
+        return chat_member.is_member
+    return chat_member.status in (ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER)
 
 async def greet_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Handles new members joining the group.
-    Sends a welcome message prompting the new member to provide their language preference.
-    Also re-initializes language setup if needed.
+    Handles members joining and leaving the group.
+    Sends a welcome message prompting a new member to provide their language preference,
+    and re-initializes language setup if needed.
+    Members who leave or are banned are removed, so their language stops being translated.
     """
     chat_member_update: ChatMemberUpdated = update.chat_member
     group_id = str(chat_member_update.chat.id)
     new_member = chat_member_update.new_chat_member.user
     user_name = new_member.full_name
+    was_member = is_chat_member(chat_member_update.old_chat_member)
+    is_member = is_chat_member(chat_member_update.new_chat_member)
 
-    await context.bot.send_message(
+    if was_member and not is_member:
+        await run_db(remove_member, group_id, str(new_member.id))
+        return
+    # Other changes (promotions, restrictions) need no greeting
+    if was_member or not is_member:
+        return
+    # A returning member's language becomes active again
+    await record_activity_async(group_id, str(new_member.id))
+
+    await send_scheduler.send(
+        group_id, context.bot.send_message, PRIORITY_BACKGROUND, kind="welcome",
         chat_id=group_id,
-        text=f"Welcome {user_name}! Please send me your preferred language (e.g., English, Español, עברית)."
+        text=system_messages.render("welcome", message_languages(group_id, new_member), user_name=user_name),
     )
     await initialize_group_if_needed(update, context)
 
-async def main():
+async def replay_outbox(app):
     """
-    Main entry point of the bot:
-    - Initializes database.
-    - Sets up message and member handlers.
-    - Starts polling updates from Telegram.
+    Translates and sends the messages a previous run accepted but did not answer.
     """
-    init_db()
-    app = ApplicationBuilder().token(TOKEN).build()
+    for entry_id, group_id, payload in await outbox.pending():
+        if not owns_chat(group_id):
+            continue
+        msg = Message.de_json(payload, app.bot)
+        target_languages = get_all_languages(group_id)
+        if msg is None or not msg.text or not target_languages:
+            outbox.complete(entry_id)
+            continue
+        metrics.increment("outbox_replayed_total")
+        await queue_translation(msg, group_id, str(msg.from_user.id), target_languages, time.perf_counter(), outbox_entry=entry_id)
+
+async def start_background_services(app):
+    """
+    Starts the metrics endpoint and the periodic metrics log once the application is initialized,
+    replays unfinished messages from the outbox, prepares the localized system messages and starts
+    recording member activity.
+    """
+    await metrics.start_metrics_server()
+    app.create_task(metrics.log_metrics_periodically())
+    # The front process of a sharded deployment never answers messages itself
+    if not is_router():
+        app.create_task(replay_outbox(app))
+        app.create_task(system_messages.warm())
+        app.create_task(maintain_members())
+
+async def stop_background_services(app):
+    """
+    Writes outstanding outbox changes and member activity before the application exits.
+    """
+    await outbox.flush()
+    await run_db(flush_activity)
+
+def build_application(receive_updates: bool = True):
+    """
+    Builds the Telegram application with all handlers registered.
+    Args:
+        receive_updates (bool): False for shard workers, which get their updates from the front process.
+    Returns:
+        telegram.ext.Application: The configured application.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES if CONCURRENT_UPDATES > 1 else False)
+        .post_init(start_background_services)
+        .post_shutdown(stop_background_services)
+    )
+    if not receive_updates:
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Handle text messages in groups
     group_filter = filters.TEXT & (filters.ChatType.GROUP | filters.ChatType.SUPERGROUP)
-    app.add_handler(MessageHandler(group_filter, handle_group_message))
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & group_filter, handle_group_message))
+
+    # Handle edits of text messages in groups
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE & group_filter, handle_edited_message))
 
     # Handle new members joining the group
     app.add_handler(ChatMemberHandler(greet_new_members, ChatMemberHandler.CHAT_MEMBER))
+    return app
+
+def run_webhook(app):
+    """
+    Receives updates through a webhook: Telegram posts each update to a local HTTP listener,
+    which rejects requests without the configured secret token.
+    """
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set when BOT_MODE is webhook")
+    if not WEBHOOK_SECRET or not _SECRET_TOKEN_RE.match(WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_SECRET must be set to 1-256 characters of A-Z, a-z, 0-9, _ and -")
+
+    print(f"Bot is running and listening for webhook updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+def main():
+    """
+    Main entry point of the bot:
+    - Initializes database and loads the group language index.
+    - Sets up message and member handlers, and the metrics endpoint.
+    - With BOT_WORKERS > 1, starts the worker processes and routes each group's updates to one of them.
+    - Receives updates from Telegram by polling or through a webhook, depending on BOT_MODE.
+    """
+    init_db()
+    app = build_application()
+
+    if BOT_WORKERS > 1:
+        # Front process only: every update is forwarded to the worker owning its chat
+        router = ShardRouter(BOT_WORKERS)
+        router.start()
+        app.add_handler(TypeHandler(Update, router.route), group=-1)
+        app.post_shutdown = router.stop
+        print(f"Routing updates to {BOT_WORKERS} worker processes...")
+    else:
+        load_language_index()
 
-    print("Bot is running and listening for messages...")
-    await app.run_polling()
+    if BOT_MODE == "webhook":
+        run_webhook(app)
+    elif BOT_MODE == "polling":
+        print("Bot is running and listening for messages...")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        raise ValueError(f"Unknown BOT_MODE '{BOT_MODE}', expected polling or webhook")
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    main()
@@ -2,29 +2,236 @@
 """
 This module handles all database operations related to user language preferences within Telegram groups.
 It uses SQLite to store each user's preferred language by group.
+
+Connections are long-lived and kept one per thread, opened in WAL mode with tuned pragmas.
+Handlers should go through run_db(), which runs database work on a dedicated thread instead of the event loop.
+
+The schema is versioned with PRAGMA user_version: init_db() creates the original tables and then applies
+every migration in MIGRATIONS that the file has not had yet, so existing databases upgrade in place.
 """
 
+import asyncio
+import logging
 import sqlite3
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Path to the SQLite database file
 DB_PATH = os.getenv("DATABASE_PATH", "translation_bot.db")
+# Page cache per connection, in KiB
+DB_CACHE_SIZE_KB = int(os.getenv("DATABASE_CACHE_SIZE_KB", "8192"))
+# Number of compiled statements kept per connection
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "256"))
+
+_local = threading.local()
+# Single thread for database work from async handlers, so writes never contend with each other
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=10, cached_statements=DB_STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed during writes; NORMAL sync is safe under WAL and skips an fsync per commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
 
 def get_db_connection():
     """
-    Establishes and returns a connection to the SQLite database.
+    Returns the calling thread's connection to the SQLite database, opening it on first use.
+    The connection is reused across calls, so callers must not close it.
+    Statements executed through it are compiled once and served from its statement cache afterwards.
     Returns:
         sqlite3.Connection: SQLite connection object.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
     return conn
 
+def close_db_connection():
+    """
+    Closes the calling thread's connection, if one is open.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs a blocking database function on the database thread without blocking the event loop.
+    Args:
+        func (callable): Function to run.
+        *args, **kwargs: Arguments passed to func.
+    Returns:
+        The return value of func.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, lambda: func(*args, **kwargs))
+
+def _migrate_compact_group_users(cursor):
+    # Integer ids and a language id instead of three TEXT columns per membership, clustered by (group_id, user_id)
+    cursor.execute("""
+        CREATE TABLE languages (
+            language_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE
+        );
+    """)
+    cursor.execute("""
+        INSERT INTO languages (code) SELECT DISTINCT language FROM group_users WHERE language IS NOT NULL ORDER BY language
+    """)
+    cursor.execute("""
+        CREATE TABLE group_users_v1 (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            language_id INTEGER NOT NULL REFERENCES languages (language_id),
+            user_name TEXT,
+            PRIMARY KEY (group_id, user_id)
+        ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+        INSERT INTO group_users_v1 (group_id, user_id, language_id, user_name)
+        SELECT CAST(group_users.group_id AS INTEGER), CAST(group_users.user_id AS INTEGER), languages.language_id, group_users.user_name
+        FROM group_users JOIN languages ON languages.code = group_users.language
+    """)
+    cursor.execute("DROP TABLE group_users")
+    cursor.execute("ALTER TABLE group_users_v1 RENAME TO group_users")
+    # Covers group -> language lookups without touching the table
+    cursor.execute("CREATE INDEX group_users_group_language ON group_users (group_id, language_id)")
+
+    # Members per language of each group, kept up to date by triggers on group_users
+    cursor.execute("""
+        CREATE TABLE group_languages (
+            group_id INTEGER NOT NULL,
+            language_id INTEGER NOT NULL REFERENCES languages (language_id),
+            members INTEGER NOT NULL,
+            PRIMARY KEY (group_id, language_id)
+        ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+        INSERT INTO group_languages (group_id, language_id, members)
+        SELECT group_id, language_id, COUNT(*) FROM group_users GROUP BY group_id, language_id
+    """)
+    add_member = """
+        INSERT INTO group_languages (group_id, language_id, members) VALUES (NEW.group_id, NEW.language_id, 1)
+        ON CONFLICT (group_id, language_id) DO UPDATE SET members = members + 1;
+    """
+    remove_member = """
+        UPDATE group_languages SET members = members - 1 WHERE group_id = OLD.group_id AND language_id = OLD.language_id;
+        DELETE FROM group_languages WHERE group_id = OLD.group_id AND language_id = OLD.language_id AND members <= 0;
+    """
+    cursor.execute(f"CREATE TRIGGER group_users_insert AFTER INSERT ON group_users BEGIN {add_member} END")
+    cursor.execute(f"CREATE TRIGGER group_users_delete AFTER DELETE ON group_users BEGIN {remove_member} END")
+    cursor.execute(f"""
+        CREATE TRIGGER group_users_update AFTER UPDATE OF group_id, language_id ON group_users
+        WHEN OLD.group_id != NEW.group_id OR OLD.language_id != NEW.language_id
+        BEGIN {remove_member} {add_member} END
+    """)
+
+def _migrate_member_activity(cursor):
+    # When each member last sent a message or joined, and the latest of those per group language.
+    # Existing members count as seen at migration time, so no group loses its languages on upgrade.
+    cursor.execute("ALTER TABLE group_users ADD COLUMN last_seen REAL NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE group_languages ADD COLUMN last_seen REAL NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE group_users SET last_seen = CAST(strftime('%s', 'now') AS REAL)")
+    cursor.execute("UPDATE group_languages SET last_seen = CAST(strftime('%s', 'now') AS REAL)")
+
+    cursor.execute("DROP TRIGGER group_users_insert")
+    cursor.execute("DROP TRIGGER group_users_delete")
+    cursor.execute("DROP TRIGGER group_users_update")
+    add_member = """
+        INSERT INTO group_languages (group_id, language_id, members, last_seen) VALUES (NEW.group_id, NEW.language_id, 1, NEW.last_seen)
+        ON CONFLICT (group_id, language_id) DO UPDATE SET members = members + 1, last_seen = MAX(last_seen, excluded.last_seen);
+    """
+    # The language's last activity is recomputed from the members it has left
+    remove_member = """
+        UPDATE group_languages SET members = members - 1, last_seen = COALESCE((
+            SELECT MAX(last_seen) FROM group_users WHERE group_id = OLD.group_id AND language_id = OLD.language_id
+        ), 0) WHERE group_id = OLD.group_id AND language_id = OLD.language_id;
+        DELETE FROM group_languages WHERE group_id = OLD.group_id AND language_id = OLD.language_id AND members <= 0;
+    """
+    cursor.execute(f"CREATE TRIGGER group_users_insert AFTER INSERT ON group_users BEGIN {add_member} END")
+    cursor.execute(f"CREATE TRIGGER group_users_delete AFTER DELETE ON group_users BEGIN {remove_member} END")
+    cursor.execute(f"""
+        CREATE TRIGGER group_users_update AFTER UPDATE OF group_id, language_id ON group_users
+        WHEN OLD.group_id != NEW.group_id OR OLD.language_id != NEW.language_id
+        BEGIN {remove_member} {add_member} END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER group_users_seen AFTER UPDATE OF last_seen ON group_users
+        WHEN NEW.last_seen > OLD.last_seen
+        BEGIN
+            UPDATE group_languages SET last_seen = MAX(last_seen, NEW.last_seen)
+            WHERE group_id = NEW.group_id AND language_id = NEW.language_id;
+        END
+    """)
+    # Finds members not seen for a long time without scanning the table
+    cursor.execute("CREATE INDEX group_users_last_seen ON group_users (last_seen)")
+
+def _migrate_translation_cache_source(cursor):
+    # Cached translations are keyed by the source language they were requested with as well.
+    # Existing rows do not record it, and being a cache they are simply dropped.
+    cursor.execute("DROP TABLE translation_cache")
+    cursor.execute("""
+        CREATE TABLE translation_cache (
+            source_text TEXT,
+            source TEXT,
+            target TEXT,
+            translation TEXT,
+            created_at REAL,
+            PRIMARY KEY (source_text, source, target)
+        );
+    """)
+
+def _migrate_translation_cache_age(cursor):
+    # Expired cached translations are pruned by age without scanning the table
+    cursor.execute("CREATE INDEX translation_cache_created_at ON translation_cache (created_at)")
+
+# Schema migrations in order; the database's user_version is the number of migrations applied
+MIGRATIONS = [
+    _migrate_compact_group_users,
+    _migrate_member_activity,
+    _migrate_translation_cache_source,
+    _migrate_translation_cache_age,
+]
+
+def migrate_db(conn):
+    """
+    Applies the migrations the database has not had yet, each in its own transaction.
+    Safe to call from several processes at once: the version is checked again under the write lock.
+    Args:
+        conn (sqlite3.Connection): Connection to migrate.
+    """
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version}")
+                logging.info(f"Migrated database to version {version} ({migration.__name__})")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
 def init_db():
     """
-    Initializes the database by creating the necessary tables if they don't exist.
+    Initializes the database by creating the necessary tables if they don't exist, then migrates it
+    to the current schema version.
     Tables:
-        - group_users: Stores group_id, user_id, user_name, and preferred language.
+        - group_users: Stores group_id, user_id, user_name, preferred language (language_id) and when the member was last seen.
+        - languages: Maps compact language ids to language codes.
+        - group_languages: Stores the number of members preferring each language in each group, and their latest activity.
+        - translation_cache: Stores recent translations keyed by source text, source language and target language.
+        - language_topics: Stores the forum topic each group uses for each language.
+        - system_messages: Stores the bot's own messages translated into each language.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -39,5 +246,34 @@ def init_db():
         );
     """)
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            source_text TEXT,
+            target TEXT,
+            translation TEXT,
+            created_at REAL,
+            PRIMARY KEY (source_text, target)
+        );
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS language_topics (
+            group_id TEXT,
+            language TEXT,
+            thread_id INTEGER,
+            PRIMARY KEY (group_id, language)
+        );
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_messages (
+            name TEXT,
+            language TEXT,
+            source TEXT,
+            text TEXT,
+            PRIMARY KEY (name, language)
+        );
+    """)
+
     conn.commit()
-    conn.close()
\ No newline at end of file
+    migrate_db(conn)
\ No newline at end of file
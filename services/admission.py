@@ -0,0 +1,149 @@
+# services/admission.py
+"""
+Admission control for group messages.
+The controller watches two signals: the number of messages waiting across all group queues, and the
+recent translation latency (a moving average of batch translation times). When either passes a threshold,
+the bot degrades one step at a time:
+1. defer: languages read by few members of a group are translated later, once the pressure is gone;
+2. merge: a new message is merged into the same sender's previous message when that one is still waiting;
+3. reject: new messages of groups that already have messages waiting are refused with a short notice.
+A group with nothing waiting is always admitted, so every group keeps being served.
+The level only steps down once both signals are well below its threshold, so it does not flap.
+"""
+
+import os
+import time
+
+from services import metrics
+from services.users_lang_manager import get_language_counts
+
+# Messages waiting across all groups at which each step starts
+ADMISSION_DEFER_DEPTH = int(os.getenv("ADMISSION_DEFER_DEPTH", "200"))
+ADMISSION_MERGE_DEPTH = int(os.getenv("ADMISSION_MERGE_DEPTH", "400"))
+ADMISSION_REJECT_DEPTH = int(os.getenv("ADMISSION_REJECT_DEPTH", "800"))
+# Average batch translation time (seconds) at which each step starts
+ADMISSION_DEFER_LATENCY = float(os.getenv("ADMISSION_DEFER_LATENCY", "2"))
+ADMISSION_MERGE_LATENCY = float(os.getenv("ADMISSION_MERGE_LATENCY", "4"))
+ADMISSION_REJECT_LATENCY = float(os.getenv("ADMISSION_REJECT_LATENCY", "8"))
+# A step ends once both signals are below this share of its thresholds
+ADMISSION_RECOVERY = float(os.getenv("ADMISSION_RECOVERY", "0.7"))
+# Languages read by fewer members than this are deferred under pressure
+ADMISSION_MINOR_LANGUAGE_MEMBERS = int(os.getenv("ADMISSION_MINOR_LANGUAGE_MEMBERS", "2"))
+# Seconds a deferred language may wait; after that the message is answered without it
+ADMISSION_DEFER_MAX_AGE = float(os.getenv("ADMISSION_DEFER_MAX_AGE", "300"))
+# Minimum seconds between two rejection notices in the same group
+ADMISSION_NOTICE_INTERVAL = float(os.getenv("ADMISSION_NOTICE_INTERVAL", "30"))
+
+NORMAL, DEFER, MERGE, REJECT = range(4)
+LEVEL_NAMES = ("normal", "defer", "merge", "reject")
+
+# Weight of the newest latency sample in the moving average
+_LATENCY_SMOOTHING = 0.2
+# Seconds without a sample after which the latency average is reset: nothing is being translated
+_LATENCY_STALE_SECONDS = 30
+
+class AdmissionController:
+    """
+    Tracks the load level from queue depth and translation latency. Used from the event loop only.
+    """
+
+    def __init__(self, depth_thresholds: tuple, latency_thresholds: tuple, recovery: float):
+        """
+        Args:
+            depth_thresholds (tuple): Total queued messages at which defer, merge and reject start.
+            latency_thresholds (tuple): Average translation seconds at which defer, merge and reject start.
+            recovery (float): Share of a step's thresholds both signals must fall below to leave it.
+        """
+        self.depth_thresholds = depth_thresholds
+        self.latency_thresholds = latency_thresholds
+        self.recovery = recovery
+        self.level = NORMAL
+        self.latency = 0.0
+        self._sampled_at = float("-inf")
+        # When each group was last told its message was refused: {group_id: monotonic time}
+        self._noticed_at = {}
+
+    @staticmethod
+    def _level_for(value: float, thresholds: tuple) -> int:
+        return sum(1 for threshold in thresholds if threshold > 0 and value >= threshold)
+
+    def observe_latency(self, seconds: float):
+        """
+        Adds a translation time sample to the moving average.
+        """
+        self.latency += _LATENCY_SMOOTHING * (seconds - self.latency)
+        self._sampled_at = time.monotonic()
+
+    def update(self, depth: int) -> int:
+        """
+        Recomputes the level from the current queue depth.
+        Args:
+            depth (int): Messages waiting across all groups.
+        Returns:
+            int: The level: NORMAL, DEFER, MERGE or REJECT.
+        """
+        if time.monotonic() - self._sampled_at > _LATENCY_STALE_SECONDS:
+            self.latency = 0.0
+        pressure = max(self._level_for(depth, self.depth_thresholds), self._level_for(self.latency, self.latency_thresholds))
+        calm = max(
+            self._level_for(depth / self.recovery, self.depth_thresholds),
+            self._level_for(self.latency / self.recovery, self.latency_thresholds),
+        )
+        level = max(pressure, min(self.level, calm))
+        if level != self.level:
+            metrics.increment("admission_level_changes_total", level=LEVEL_NAMES[level])
+            self.level = level
+        return level
+
+    def split_languages(self, group_id: str, languages: list) -> tuple[list, list]:
+        """
+        Splits a message's target languages into those translated now and those deferred.
+        Nothing is deferred below the DEFER level, and a group's most read language never is.
+        Args:
+            group_id (str): Telegram group identifier.
+            languages (list): Target language codes.
+        Returns:
+            tuple[list, list]: Languages to translate now, and languages to defer.
+        """
+        if self.level < DEFER or len(languages) < 2:
+            return list(languages), []
+        counts = get_language_counts(group_id)
+        top = max(languages, key=lambda lang_code: counts.get(lang_code, 0))
+        now, deferred = [], []
+        for lang_code in languages:
+            if lang_code == top or counts.get(lang_code, 0) >= ADMISSION_MINOR_LANGUAGE_MEMBERS:
+                now.append(lang_code)
+            else:
+                deferred.append(lang_code)
+        return now, deferred
+
+    def should_notify(self, group_id: str) -> bool:
+        """
+        Tells whether a group may be sent a rejection notice now, so a busy group gets one notice
+        per ADMISSION_NOTICE_INTERVAL instead of one per refused message.
+        """
+        now = time.monotonic()
+        if now - self._noticed_at.get(group_id, float("-inf")) < ADMISSION_NOTICE_INTERVAL:
+            return False
+        if len(self._noticed_at) > 10000:
+            self._noticed_at = {
+                key: noticed_at for key, noticed_at in self._noticed_at.items()
+                if now - noticed_at < ADMISSION_NOTICE_INTERVAL
+            }
+        self._noticed_at[group_id] = now
+        return True
+
+admission = AdmissionController(
+    (ADMISSION_DEFER_DEPTH, ADMISSION_MERGE_DEPTH, ADMISSION_REJECT_DEPTH),
+    (ADMISSION_DEFER_LATENCY, ADMISSION_MERGE_LATENCY, ADMISSION_REJECT_LATENCY),
+    ADMISSION_RECOVERY,
+)
+
+metrics.describe("admission_level_changes_total", "Admission level changes, by new level")
+metrics.describe("admission_actions_total", "Messages affected by load shedding, by action (deferred, merged, rejected, expired)")
+metrics.register_callback("admission_level", lambda: admission.level, description="Load shedding level: 0 normal, 1 defer, 2 merge, 3 reject")
+metrics.register_callback(
+    "admission_translation_latency_seconds",
+    lambda: admission.latency,
+    description="Moving average of batch translation time seen by admission control",
+)
@@ -0,0 +1,230 @@
+# services/backends.py
+"""
+Translation backends used by the translator service.
+Every backend offers the same interface - sync and async, single text and batch - so the translation
+pipeline can run against Google Translate in production or against a local fake backend for load tests.
+The backend is selected with the TRANSLATION_BACKEND environment variable.
+"""
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from deep_translator import GoogleTranslator
+from deep_translator.exceptions import LanguageNotSupportedException, NotValidLength, NotValidPayload
+
+# Name of the backend used by the translator: google or fake
+TRANSLATION_BACKEND = os.getenv("TRANSLATION_BACKEND", "google")
+# Threads for each backend's blocking requests. A request abandoned at its deadline keeps its thread
+# until the network gives up, so a backend gets its own pool and cannot starve the others.
+TRANSLATION_BACKEND_THREADS = int(os.getenv("TRANSLATION_BACKEND_THREADS", "16"))
+
+# Joins batched texts into one request; chosen to pass through translation unchanged
+BATCH_DELIMITER = "\n§\n"
+_BATCH_SPLIT_RE = re.compile(r"\s*§\s*")
+
+_executor_lock = threading.Lock()
+
+class TranslationBackend:
+    """
+    Base class for translation backends.
+    Subclasses implement translate(); the batch and async variants have working defaults that
+    subclasses with native support can override.
+    """
+
+    name = "base"
+    # Longest text accepted in a single request
+    max_request_chars = 4500
+    # Errors caused by the request itself, which retrying or another backend cannot fix
+    permanent_errors = ()
+    # Pool running blocking requests, created on first use, and the requests submitted to it and not finished
+    _executor = None
+    _outstanding = 0
+
+    @property
+    def saturated(self) -> bool:
+        """
+        True while every request thread is taken, e.g. by requests that outlived their deadline;
+        new requests would only queue behind them.
+        """
+        return self._outstanding >= TRANSLATION_BACKEND_THREADS
+
+    def translate(self, text: str, target: str, source: str = "auto") -> str:
+        """
+        Translates a text into one language. Blocks on I/O.
+        Args:
+            text (str): Text to translate.
+            target (str): Target language code.
+            source (str): Source language code, or 'auto' to let the backend detect it.
+        Returns:
+            str: The translated text.
+        """
+        raise NotImplementedError
+
+    def translate_batch(self, texts: list, target: str, source: str = "auto") -> list:
+        """
+        Translates several texts into one language with as few requests as possible.
+        Texts are joined with BATCH_DELIMITER into requests of up to max_request_chars;
+        if the delimiters do not survive translation, that request is redone text by text.
+        Args:
+            texts (list): Texts to translate.
+            target (str): Target language code.
+            source (str): Source language code, or 'auto'.
+        Returns:
+            list: Translated text, or the exception raised, for each input text in order.
+        """
+        results = [None] * len(texts)
+        for chunk in self._pack(texts):
+            parts = None
+            if len(chunk) > 1:
+                try:
+                    joined = BATCH_DELIMITER.join(texts[index] for index in chunk)
+                    parts = _BATCH_SPLIT_RE.split(self.translate(joined, target, source).strip())
+                except Exception:
+                    parts = None
+                if parts is not None and len(parts) != len(chunk):
+                    parts = None
+            if parts is None:
+                parts = []
+                for index in chunk:
+                    try:
+                        parts.append(self.translate(texts[index], target, source))
+                    except Exception as e:
+                        parts.append(e)
+            for index, translated_text in zip(chunk, parts):
+                results[index] = translated_text
+        return results
+
+    async def translate_async(self, text: str, target: str, source: str = "auto") -> str:
+        return await self._run_in_thread(self.translate, text, target, source)
+
+    async def translate_batch_async(self, texts: list, target: str, source: str = "auto") -> list:
+        return await self._run_in_thread(self.translate_batch, texts, target, source)
+
+    async def _run_in_thread(self, func, *args):
+        with _executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=TRANSLATION_BACKEND_THREADS, thread_name_prefix=f"translate-{self.name}")
+            self._outstanding += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._release_thread(None)
+            raise
+        # Also called when a queued request is cancelled before it starts
+        future.add_done_callback(self._release_thread)
+        return await asyncio.wrap_future(future)
+
+    def _release_thread(self, _future):
+        with _executor_lock:
+            self._outstanding -= 1
+
+    def _pack(self, texts: list) -> list[list[int]]:
+        # Texts containing the delimiter, or too long to share a request, get a request of their own
+        chunks = []
+        current = []
+        current_length = 0
+        for index, text in enumerate(texts):
+            length = len(text) + len(BATCH_DELIMITER)
+            if "§" in text or length > self.max_request_chars:
+                chunks.append([index])
+                continue
+            if current and current_length + length > self.max_request_chars:
+                chunks.append(current)
+                current = []
+                current_length = 0
+            current.append(index)
+            current_length += length
+        if current:
+            chunks.append(current)
+        return chunks
+
+class GoogleBackend(TranslationBackend):
+    """
+    Google Translate through deep_translator.
+    """
+
+    name = "google"
+    permanent_errors = (LanguageNotSupportedException, NotValidLength, NotValidPayload)
+
+    def translate(self, text: str, target: str, source: str = "auto") -> str:
+        # GoogleTranslator keeps per-request state, so it is not shared between threads
+        return GoogleTranslator(source=source, target=target).translate(text=text)
+
+class FakeBackend(TranslationBackend):
+    """
+    Local stand-in for load testing. Returns "[<target>] <text>" for every line after a simulated
+    network delay, and fails a configurable share of requests. Seeded, so runs are repeatable.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def translate(self, text: str, target: str, source: str = "auto") -> str:
+        delay, failed = self._sample()
+        time.sleep(delay)
+        return self._finish(failed, text, target)
+
+    def translate_batch(self, texts: list, target: str, source: str = "auto") -> list:
+        delay, failed = self._sample()
+        time.sleep(delay)
+        return [self._finish(failed, text, target) for text in texts]
+
+    async def translate_async(self, text: str, target: str, source: str = "auto") -> str:
+        delay, failed = self._sample()
+        await asyncio.sleep(delay)
+        return self._finish(failed, text, target)
+
+    async def translate_batch_async(self, texts: list, target: str, source: str = "auto") -> list:
+        delay, failed = self._sample()
+        await asyncio.sleep(delay)
+        return [self._finish(failed, text, target) for text in texts]
+
+    def _sample(self) -> tuple[float, bool]:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.failure_rate
+        return delay, failed
+
+    def _finish(self, failed: bool, text: str, target: str) -> str:
+        if failed:
+            raise RuntimeError("Simulated backend failure")
+        return self._render(text, target)
+
+    @staticmethod
+    def _render(text: str, target: str) -> str:
+        return "\n".join(
+            line if line.strip() in ("", "§") else f"[{target}] {line}"
+            for line in text.split("\n")
+        )
+
+def create_backend(name: str) -> TranslationBackend:
+    """
+    Creates a translation backend by name, configured from the environment.
+    Args:
+        name (str): Backend name: google or fake.
+    Returns:
+        TranslationBackend: The backend instance.
+    """
+    if name == "google":
+        return GoogleBackend()
+    if name == "fake":
+        return FakeBackend(
+            latency=float(os.getenv("FAKE_BACKEND_LATENCY_MS", "200")) / 1000,
+            jitter=float(os.getenv("FAKE_BACKEND_JITTER_MS", "50")) / 1000,
+            failure_rate=float(os.getenv("FAKE_BACKEND_FAILURE_RATE", "0")),
+            seed=int(os.getenv("FAKE_BACKEND_SEED", "0")),
+        )
+    raise ValueError(f"Unknown translation backend '{name}'")
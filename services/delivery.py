@@ -0,0 +1,147 @@
+# services/delivery.py
+"""
+Per-recipient delivery of translations, as an alternative to one group reply listing every language.
+Each language's translation is sent once, only to the members who read it:
+- topics: into a forum topic per language, created in the group on first use.
+- direct: as a private message to each member preferring that language.
+
+Messages go out through the send scheduler, which paces them per destination and overall. Translations
+that pile up for a destination while it waits are combined into a single message, so a burst in a busy
+group costs each recipient one message instead of one per group message.
+"""
+
+import logging
+import os
+
+from telegram.error import BadRequest, Forbidden
+
+from database.models import get_db_connection, run_db
+from services import metrics
+from services.send_scheduler import send_scheduler, PRIORITY_TRANSLATION, MESSAGE_LIMIT
+from services.translator import LANGUAGE_NAMES
+
+# How translations are delivered: group (one reply with every language), topics or direct
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "group")
+
+DELIVERY_MODES = ("group", "topics", "direct")
+if DELIVERY_MODE not in DELIVERY_MODES:
+    raise ValueError(f"DELIVERY_MODE must be one of {', '.join(DELIVERY_MODES)}")
+
+# Forum topic per language: {(group_id, language): thread_id}
+_topics = {}
+# Groups where topics cannot be created (not a forum, or no right to manage topics)
+_topics_unavailable = set()
+
+metrics.describe("delivery_messages_total", "Translations sent to recipients in per-recipient delivery, by mode and outcome")
+metrics.describe("delivery_texts_total", "Translations delivered to recipients, by mode")
+
+def _load_topics(group_id: str) -> dict:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT language, thread_id FROM language_topics WHERE group_id = ?
+    """, (group_id,))
+    return {row["language"]: row["thread_id"] for row in cursor.fetchall()}
+
+def _save_topic(group_id: str, language: str, thread_id: int):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO language_topics (group_id, language, thread_id)
+        VALUES (?, ?, ?)
+        ON CONFLICT(group_id, language) DO UPDATE SET thread_id=excluded.thread_id
+    """, (group_id, language, thread_id))
+    conn.commit()
+
+async def get_language_topic(bot, group_id: str, language: str) -> int | None:
+    """
+    Returns the forum topic of a language in a group, creating it on first use.
+    Args:
+        bot (telegram.Bot): The bot.
+        group_id (str): Telegram group identifier.
+        language (str): Language code.
+    Returns:
+        int | None: The topic's message thread id, or None if the group cannot have topics.
+    """
+    if group_id in _topics_unavailable:
+        return None
+    if (group_id, language) not in _topics:
+        for stored_language, thread_id in (await run_db(_load_topics, group_id)).items():
+            _topics[(group_id, stored_language)] = thread_id
+    if (group_id, language) not in _topics:
+        try:
+            topic = await bot.create_forum_topic(chat_id=group_id, name=LANGUAGE_NAMES.get(language, language))
+        except (BadRequest, Forbidden) as e:
+            logging.warning(f"Cannot create language topics in group {group_id}, replying in the group instead: {e}")
+            _topics_unavailable.add(group_id)
+            return None
+        _topics[(group_id, language)] = topic.message_thread_id
+        await run_db(_save_topic, group_id, language, topic.message_thread_id)
+    return _topics[(group_id, language)]
+
+def _render(translated_text) -> str:
+    if isinstance(translated_text, Exception):
+        return f"Translation failed ({str(translated_text) or type(translated_text).__name__})"
+    return translated_text
+
+async def deliver_translations(bot, group_id: str, group_title: str, sender_name: str, results: dict, members_by_language: dict) -> bool:
+    """
+    Sends each language's translation to the members who read it, according to DELIVERY_MODE.
+    Args:
+        bot (telegram.Bot): The bot.
+        group_id (str): Telegram group identifier.
+        group_title (str): Group name, shown in direct messages.
+        sender_name (str): Display name of the message's author.
+        results (dict): Language code -> translated text, or the exception raised for that language.
+        members_by_language (dict): Language code -> user ids of the members preferring it.
+    Returns:
+        bool: False if the translations could not be delivered per recipient and belong in a group reply.
+    """
+    if DELIVERY_MODE == "topics":
+        # Every topic is resolved before anything is sent: if one cannot be created, the whole message
+        # falls back to the group reply instead of reaching some languages twice
+        threads = {}
+        for language in results:
+            thread_id = await get_language_topic(bot, group_id, language)
+            if thread_id is None:
+                return False
+            threads[language] = thread_id
+        for language, translated_text in results.items():
+            enqueue(bot, group_id, f"{sender_name}: {_render(translated_text)}", threads[language])
+    elif DELIVERY_MODE == "direct":
+        for language, translated_text in results.items():
+            for user_id in members_by_language.get(language, ()):
+                enqueue(bot, user_id, f"{group_title} · {sender_name}: {_render(translated_text)}")
+    else:
+        return False
+    metrics.increment("delivery_texts_total", len(results), mode=DELIVERY_MODE)
+    return True
+
+def enqueue(bot, chat_id, text: str, thread_id: int | None = None):
+    """
+    Queues a text for a chat (or a topic of it) in the send scheduler, combined with texts already waiting there.
+    Args:
+        bot (telegram.Bot): The bot.
+        chat_id (str | int): Destination chat.
+        text (str): Text to send; an oversized text is cut to fit one message.
+        thread_id (int | None): Forum topic within the chat.
+    """
+    future = send_scheduler.submit(
+        chat_id, bot.send_message, PRIORITY_TRANSLATION, merge=True,
+        chat_id=chat_id, text=text[:MESSAGE_LIMIT], message_thread_id=thread_id,
+    )
+    future.add_done_callback(lambda done: _record_delivery(chat_id, done))
+
+def _record_delivery(chat_id, future):
+    if future.cancelled():
+        metrics.increment("delivery_messages_total", mode=DELIVERY_MODE, outcome="cancelled")
+        return
+    error = future.exception()
+    if error is None:
+        metrics.increment("delivery_messages_total", mode=DELIVERY_MODE, outcome="ok")
+    elif isinstance(error, Forbidden):
+        # The member never started a private chat with the bot, or blocked it
+        metrics.increment("delivery_messages_total", mode=DELIVERY_MODE, outcome="unreachable")
+    else:
+        metrics.increment("delivery_messages_total", mode=DELIVERY_MODE, outcome="error")
+        logging.error(f"Delivering translations to {chat_id} failed: {error}")
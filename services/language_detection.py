@@ -0,0 +1,242 @@
+# services/language_detection.py
+"""
+Fast local language identification, run before translation so the bot can skip targets that match the
+message's own language and tell the backend the source language instead of asking it to detect it.
+
+Detection works in three steps, all on in-process tables:
+- The dominant Unicode script decides outright for scripts used by a single language (Hebrew, Greek, Thai, ...).
+- Letters specific to one language separate languages sharing a script (Persian vs. Arabic, Ukrainian vs. Russian).
+  Where the script has word profiles, they are only trusted when the words agree, or when there are enough
+  of them and the words say nothing, so a name or place in another language ("José Muñoz", "Łódź") does not decide.
+- Profiles of frequent short words score languages written in the Latin and Cyrillic scripts.
+
+Only codes from LANGUAGE_CODES are returned, and None is returned whenever the text is too short
+or too ambiguous, in which case callers keep the old behavior (auto-detect, translate to every target).
+"""
+
+import re
+from collections import Counter
+
+# Text is ignored for detection when it has fewer letters than this
+MIN_LETTERS = 3
+# Share of letters the dominant script must have
+MIN_SCRIPT_SHARE = 0.6
+# Share of letters that must be distinctive of a language for them to decide without support from the words
+MIN_DISTINCTIVE_SHARE = 0.05
+
+_NOISE_RE = re.compile(r"https?://\S+|www\.\S+|@\w+|/\w+|#\w+|`[^`]*`")
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+# (first code point, last code point, script)
+_SCRIPT_RANGES = (
+    (0x0041, 0x024F, "latin"),
+    (0x0370, 0x03FF, "greek"),
+    (0x0400, 0x04FF, "cyrillic"),
+    (0x0530, 0x058F, "armenian"),
+    (0x0590, 0x05FF, "hebrew"),
+    (0x0600, 0x06FF, "arabic"),
+    (0x0750, 0x077F, "arabic"),
+    (0x0780, 0x07BF, "thaana"),
+    (0x0900, 0x097F, "devanagari"),
+    (0x0980, 0x09FF, "bengali"),
+    (0x0A00, 0x0A7F, "gurmukhi"),
+    (0x0A80, 0x0AFF, "gujarati"),
+    (0x0B00, 0x0B7F, "oriya"),
+    (0x0B80, 0x0BFF, "tamil"),
+    (0x0C00, 0x0C7F, "telugu"),
+    (0x0C80, 0x0CFF, "kannada"),
+    (0x0D00, 0x0D7F, "malayalam"),
+    (0x0D80, 0x0DFF, "sinhala"),
+    (0x0E00, 0x0E7F, "thai"),
+    (0x0E80, 0x0EFF, "lao"),
+    (0x1000, 0x109F, "myanmar"),
+    (0x10A0, 0x10FF, "georgian"),
+    (0x1100, 0x11FF, "hangul"),
+    (0x1200, 0x139F, "ethiopic"),
+    (0x1780, 0x17FF, "khmer"),
+    (0x1E00, 0x1EFF, "latin"),
+    (0x3040, 0x30FF, "kana"),
+    (0x3400, 0x4DBF, "han"),
+    (0x4E00, 0x9FFF, "han"),
+    (0xABC0, 0xABFF, "meetei"),
+    (0xAC00, 0xD7AF, "hangul"),
+)
+
+# Scripts written by exactly one of the supported languages
+_SINGLE_LANGUAGE_SCRIPTS = {
+    "greek": "el",
+    "armenian": "hy",
+    "thaana": "dv",
+    "gurmukhi": "pa",
+    "gujarati": "gu",
+    "oriya": "or",
+    "tamil": "ta",
+    "telugu": "te",
+    "kannada": "kn",
+    "malayalam": "ml",
+    "sinhala": "si",
+    "thai": "th",
+    "lao": "lo",
+    "myanmar": "my",
+    "georgian": "ka",
+    "hangul": "ko",
+    "khmer": "km",
+    "meetei": "mni-Mtei",
+}
+
+# Letters that only one language of a shared script uses, checked in order
+_DISTINCTIVE_LETTERS = {
+    "hebrew": (("yi", "ײװױ"),),
+    "arabic": (
+        ("sd", "ٻڄڃڇڊڌڍڏڙڦڪ"),
+        ("ps", "ټډړږښځڅ"),
+        ("ckb", "ڕڵێ"),
+        ("ug", "ېۇۈۋ"),
+        ("ur", "ٹڈڑںے"),
+        ("fa", "پچژگیک"),
+    ),
+    "cyrillic": (
+        ("tt", "җ"),
+        ("kk", "әғқұһ"),
+        ("uk", "іїєґ"),
+        ("be", "ў"),
+        ("tg", "ӣӯҳҷ"),
+        ("sr", "ђћџјљњ"),
+        ("mk", "ѓќѕ"),
+    ),
+    "bengali": (("as", "ৰৱ"),),
+    "latin": (
+        ("tr", "ğış"),
+        ("pl", "łśźżń"),
+        ("cs", "ěřů"),
+        ("ro", "ășț"),
+        ("hu", "őű"),
+        ("vi", "ơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹđ"),
+        ("de", "ß"),
+        ("es", "ñ¿¡"),
+        ("pt", "ãõ"),
+    ),
+}
+
+# Fallback per script when no distinctive letter or word profile decides
+_SCRIPT_DEFAULTS = {
+    "hebrew": "iw",
+    "arabic": "ar",
+    "bengali": "bn",
+}
+
+# Frequent short words per language, for scripts shared by many languages
+_WORD_PROFILES = {
+    "latin": {
+        "en": "the and is are you to of in it that this for with was have not be on what we they my your i",
+        "es": "el la los las de que y en es un una por con para no lo su al del pero como más muy estoy",
+        "fr": "le la les de des et est un une que pour pas vous je il elle nous dans sur avec ce qui au",
+        "de": "der die das und ist nicht ich du sie wir ein eine zu mit auf für den dem von auch es sind",
+        "it": "il lo la gli le di che e è un una per non sono con del della ma come anche ho mi",
+        "pt": "o a os as de que e é um uma para não com do da em por mas você eu está muito",
+        "nl": "de het een en is van ik je dat niet op te met zijn voor maar ook wat er",
+        "sv": "och att det som är en ett jag du inte på för med har vi de av till",
+        "id": "yang dan di ini itu dengan untuk tidak saya kamu ada dari ke akan juga",
+        "tr": "ve bir bu da de için ne ben sen çok var mı ama gibi daha",
+        "pl": "i w na nie się to że jest jak z do co ale tak",
+    },
+    "cyrillic": {
+        "ru": "и в не на я что он с как это по но вы мы они так все был она его",
+        "bg": "и в не на да е се че за съм са как това те ние но от по",
+        "uk": "і в не на що я він з як це та але ми ви вони так",
+        "sr": "и у не на да је се што са као то ми ви они али",
+    },
+    "hebrew": {
+        "iw": "של את זה לא על אני הוא היא עם גם מה כל יש אם",
+        "yi": "און איז ניט דער די דאס איך מיט אויף פון נישט",
+    },
+}
+_WORD_PROFILES = {
+    script: {code: frozenset(words.split()) for code, words in profiles.items()}
+    for script, profiles in _WORD_PROFILES.items()
+}
+
+def _script_of(char: str) -> str | None:
+    code_point = ord(char)
+    if code_point < 0x80:
+        return "latin"
+    for first, last, script in _SCRIPT_RANGES:
+        if first <= code_point <= last:
+            return script
+    return None
+
+def dominant_script(text: str) -> tuple[str | None, int]:
+    """
+    Finds the script most letters of the text are written in.
+    Args:
+        text (str): Text to inspect.
+    Returns:
+        tuple[str | None, int]: The script (None if no script reaches MIN_SCRIPT_SHARE) and the number of letters.
+    """
+    scripts = Counter()
+    for char in text:
+        if char.isalpha():
+            scripts[_script_of(char)] += 1
+    letters = sum(scripts.values())
+    if not letters:
+        return None, 0
+    script, count = scripts.most_common(1)[0]
+    # Japanese mixes kana with Han characters
+    if scripts["kana"] and script in ("han", "kana"):
+        return "kana", letters
+    if count / letters < MIN_SCRIPT_SHARE:
+        return None, letters
+    return script, letters
+
+def _score_words(text: str, profiles: dict) -> str | None:
+    words = [word.lower() for word in _WORD_RE.findall(text)]
+    if not words:
+        return None
+    scores = Counter()
+    for word in words:
+        for code, profile in profiles.items():
+            if word in profile:
+                scores[code] += 1
+    ranked = scores.most_common(2)
+    if not ranked:
+        return None
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    # Require clear evidence: at least two hits, or hits on half the words of a very short message,
+    # and a lead over the rest
+    if best_score > runner_up and (best_score >= 2 or (len(words) <= 3 and best_score * 2 >= len(words))):
+        return best
+    return None
+
+def detect_language(text: str) -> str | None:
+    """
+    Identifies the language of a message locally.
+    Args:
+        text (str): Message text.
+    Returns:
+        str | None: A language code from LANGUAGE_CODES, or None if the language is uncertain.
+    """
+    text = _NOISE_RE.sub(" ", text)
+    script, letters = dominant_script(text)
+    if script is None or letters < MIN_LETTERS:
+        return None
+    if script in _SINGLE_LANGUAGE_SCRIPTS:
+        return _SINGLE_LANGUAGE_SCRIPTS[script]
+    if script == "kana":
+        return "ja"
+
+    profiles = _WORD_PROFILES.get(script)
+    detected = _score_words(text, profiles) if profiles else None
+    lowered = text.lower()
+    for code, distinctive in _DISTINCTIVE_LETTERS.get(script, ()):
+        hits = sum(1 for char in lowered if char in distinctive)
+        if not hits:
+            continue
+        # Without word profiles for the script, the letters are all the evidence there is
+        if code == detected or (detected is None and (not profiles or hits / letters >= MIN_DISTINCTIVE_SHARE)):
+            return code
+        # Letters of one language, words of another (or too few letters to tell): leave it to the backend
+        return None
+    if detected is not None:
+        return detected
+    return _SCRIPT_DEFAULTS.get(script)
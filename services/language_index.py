@@ -0,0 +1,152 @@
+# services/language_index.py
+"""
+Resolves free-text language names to language codes.
+All accepted names - English names, native names, ISO codes and common aliases - are normalized
+(case, accents, punctuation) and stored in a trie built once at import of the translator.
+A name resolves by exact match, by an unambiguous prefix ("portug"), or by a close spelling ("frnech", "germna");
+anything else gets ranked suggestions.
+"""
+
+import re
+import unicodedata
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a language name for lookup: case-folded, without accents and punctuation.
+    Args:
+        name (str): Language name as typed.
+    Returns:
+        str: The normalized name.
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_WORD_RE.sub(" ", stripped).strip()
+
+class _Node:
+    __slots__ = ("children", "code", "codes")
+
+    def __init__(self):
+        self.children = {}
+        # Code of the name ending here, and codes of all names below this node
+        self.code = None
+        self.codes = set()
+
+class LanguageIndex:
+    """
+    Trie of normalized language names with exact, prefix and edit-distance lookup.
+    """
+
+    # Shortest input resolved by prefix; shorter prefixes are mostly ambiguous
+    MIN_PREFIX_LENGTH = 3
+
+    def __init__(self, names: dict):
+        """
+        Args:
+            names (dict): Language name -> language code, for every accepted spelling.
+        """
+        self._root = _Node()
+        self._exact = {}
+        for name, code in names.items():
+            key = normalize_name(name)
+            if key:
+                self._exact.setdefault(key, code)
+                self._insert(key, code)
+
+    def _insert(self, key: str, code: str):
+        node = self._root
+        node.codes.add(code)
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+            node.codes.add(code)
+        if node.code is None:
+            node.code = code
+
+    def resolve(self, name: str) -> str | None:
+        """
+        Returns the code of a language name, accepting unambiguous prefixes and small typos.
+        Args:
+            name (str): Language name as typed.
+        Returns:
+            str | None: The language code, or None if the name matches no language or several.
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+        code = self._exact.get(key)
+        if code is not None:
+            return code
+        if len(key) >= self.MIN_PREFIX_LENGTH:
+            node = self._find(key)
+            if node is not None and len(node.codes) == 1:
+                return next(iter(node.codes))
+        matches = self._fuzzy(key, self._max_distance(key))
+        if matches:
+            best = min(matches.values())
+            closest = [code for code, distance in matches.items() if distance == best]
+            if len(closest) == 1:
+                return closest[0]
+        return None
+
+    def suggest(self, name: str, limit: int = 5) -> list[str]:
+        """
+        Returns the codes of the languages closest to a name, best first:
+        languages starting with the name, then by edit distance.
+        Args:
+            name (str): Language name as typed.
+            limit (int): Maximum number of suggestions.
+        Returns:
+            list[str]: Language codes.
+        """
+        key = normalize_name(name)
+        if not key:
+            return []
+        ranked = {}
+        node = self._find(key)
+        if node is not None:
+            for code in node.codes:
+                ranked[code] = -1
+        for code, distance in self._fuzzy(key, max(1, len(key) // 3)).items():
+            ranked.setdefault(code, distance)
+        return sorted(ranked, key=lambda code: (ranked[code], code))[:limit]
+
+    @staticmethod
+    def _max_distance(key: str) -> int:
+        # One typo per four characters, so short names must be nearly exact
+        return len(key) // 4
+
+    def _find(self, key: str) -> _Node | None:
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _fuzzy(self, key: str, max_distance: int) -> dict:
+        # Edit distance (with adjacent transpositions) against every name, computed one trie level at a time
+        # so shared prefixes are only compared once and branches already too far away are skipped
+        matches = {}
+        if max_distance <= 0:
+            return matches
+        first_row = list(range(len(key) + 1))
+        stack = [(child, char, first_row, None, None) for char, child in self._root.children.items()]
+        while stack:
+            node, char, previous_row, before_previous_row, previous_char = stack.pop()
+            row = [previous_row[0] + 1]
+            for column in range(1, len(key) + 1):
+                distance = min(
+                    row[column - 1] + 1,
+                    previous_row[column] + 1,
+                    previous_row[column - 1] + (key[column - 1] != char),
+                )
+                if before_previous_row is not None and column > 1 and key[column - 1] == previous_char and key[column - 2] == char:
+                    distance = min(distance, before_previous_row[column - 2] + 1)
+                row.append(distance)
+            if node.code is not None and row[-1] <= max_distance:
+                if row[-1] < matches.get(node.code, max_distance + 1):
+                    matches[node.code] = row[-1]
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row, previous_row, char) for next_char, child in node.children.items())
+        return matches
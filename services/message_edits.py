@@ -0,0 +1,167 @@
+# services/message_edits.py
+"""
+This service module keeps the translation reply of recent messages so that, when a user edits a message,
+only the sentences that changed are retranslated and the existing reply can be edited in place.
+An edit of a message that is still queued or being translated is held until its reply exists, then applied to it.
+Messages answered in a way that cannot be edited in place (per recipient, or over several reply messages) are
+remembered too, so their edits are not answered with a second full translation.
+Changed sentences go through the same pre-filter as new messages: links, mentions, commands, hashtags and code
+are masked before translation and restored afterwards, and sentences with nothing to translate are kept as they are.
+"""
+
+import asyncio
+import difflib
+import os
+from collections import Counter, OrderedDict
+
+from services import metrics
+from services.message_filter import untranslatable_reason, mask_spans, restore_spans
+from services.segmentation import split_sentences, join_translated
+from services.translator import translate_batch_to_language
+
+# Number of recent messages whose translation replies are remembered
+EDIT_HISTORY_SIZE = int(os.getenv("EDIT_HISTORY_SIZE", "5000"))
+
+# {(group_id, message_id): {"reply_message_id": int | None, "text": str, "translations": {language: str}}}
+_history = OrderedDict()
+# Messages queued or being translated, with their latest held edit: {(group_id, message_id): edited message or None}
+_pending = {}
+
+metrics.describe("edit_sentences_total", "Sentences of edited messages, by whether their translation was reused or redone")
+
+def remember_translation(group_id: str, message_id: int, reply_message_id: int, text: str, results: dict):
+    """
+    Records the translation reply sent for a message.
+    Args:
+        group_id (str): Telegram group identifier.
+        message_id (int): The translated message.
+        reply_message_id (int | None): The bot's reply holding the translations, or None if the translations
+            cannot be edited in place.
+        text (str): The message text that was translated.
+        results (dict): Language code -> translated text, or the exception raised for that language.
+    """
+    _history[(group_id, message_id)] = {
+        "reply_message_id": reply_message_id,
+        "text": text,
+        "translations": {
+            lang_code: translated_text
+            for lang_code, translated_text in results.items()
+            if not isinstance(translated_text, Exception)
+        },
+    }
+    _history.move_to_end((group_id, message_id))
+    while len(_history) > EDIT_HISTORY_SIZE:
+        _history.popitem(last=False)
+
+def get_translation_record(group_id: str, message_id: int) -> dict | None:
+    return _history.get((group_id, message_id))
+
+def mark_pending(group_id: str, message_id: int):
+    """
+    Records that a message is queued for translation, so its edits are held until it is answered.
+    """
+    _pending.setdefault((group_id, message_id), None)
+
+def hold_edit(group_id: str, message_id: int, edited) -> bool:
+    """
+    Holds the edit of a message that is still pending; a later edit replaces an earlier one.
+    Args:
+        group_id (str): Telegram group identifier.
+        message_id (int): The edited message.
+        edited (telegram.Message): The message as edited.
+    Returns:
+        bool: False if the message is not pending and the edit has to be handled now.
+    """
+    if (group_id, message_id) not in _pending:
+        return False
+    _pending[(group_id, message_id)] = edited
+    return True
+
+def finish_pending(group_id: str, message_id: int):
+    """
+    Ends a message's pending state once it is answered or dropped.
+    Returns:
+        telegram.Message | None: The latest edit held meanwhile, to apply now, or None.
+    """
+    return _pending.pop((group_id, message_id), None)
+
+def _plan_edit(old_sentences: list, new_sentences: list, old_translation: str) -> list | None:
+    """
+    Maps each new sentence to the reusable translation of an unchanged old sentence, or None if it
+    has to be translated. Returns None when the old translation cannot be aligned sentence by sentence.
+    """
+    translated_sentences = split_sentences(old_translation)
+    if len(translated_sentences) != len(old_sentences):
+        return None
+    plan = [None] * len(new_sentences)
+    matcher = difflib.SequenceMatcher(
+        None,
+        [sentence.strip() for sentence in old_sentences],
+        [sentence.strip() for sentence in new_sentences],
+        autojunk=False,
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                plan[j1 + offset] = translated_sentences[i1 + offset]
+    return plan
+
+async def retranslate_edit(group_id: str, message_id: int, new_text: str, languages: list, source: str = "auto") -> tuple[int | None, dict]:
+    """
+    Translates an edited message, reusing the previous translation of every unchanged sentence.
+    Args:
+        group_id (str): Telegram group identifier.
+        message_id (int): The edited message.
+        new_text (str): The message text after the edit.
+        languages (list): Target language codes.
+        source (str): Source language code, or 'auto'.
+    Returns:
+        tuple[int | None, dict]: The reply to edit (None if the message has no translation reply to edit)
+            and the language code -> translated text (or exception) results.
+    """
+    record = _history.get((group_id, message_id))
+    if record is None or record["reply_message_id"] is None:
+        return None, {}
+
+    old_sentences = split_sentences(record["text"])
+    new_sentences = split_sentences(new_text)
+
+    # Per language: the sentences to translate, and how to put the full translation back together
+    plans = {}
+    for lang_code in languages:
+        old_translation = record["translations"].get(lang_code)
+        plan = _plan_edit(old_sentences, new_sentences, old_translation) if old_translation else None
+        if plan is None:
+            plan = [None] * len(new_sentences)
+        plans[lang_code] = plan
+
+    async def translate_missing(lang_code, plan):
+        missing = [index for index, translated in enumerate(plan) if translated is None]
+        metrics.increment("edit_sentences_total", len(plan) - len(missing), action="reused")
+        metrics.increment("edit_sentences_total", len(missing), action="translated")
+        skipped = Counter()
+        for index in list(missing):
+            reason = untranslatable_reason(new_sentences[index])
+            if reason is not None:
+                skipped[reason] += 1
+                plan[index] = new_sentences[index]
+                missing.remove(index)
+        for reason, count in skipped.items():
+            metrics.increment("translator_targets_skipped_total", count, reason=reason)
+        if not missing:
+            return None
+        masked = [mask_spans(new_sentences[index]) for index in missing]
+        translated = await translate_batch_to_language([text for text, _ in masked], lang_code, source=source)
+        for index, (_, spans), translated_text in zip(missing, masked, translated):
+            if isinstance(translated_text, Exception):
+                return translated_text
+            plan[index] = restore_spans(translated_text, spans)
+        return None
+
+    errors = await asyncio.gather(*(translate_missing(lang_code, plan) for lang_code, plan in plans.items()))
+
+    results = {}
+    for (lang_code, plan), error in zip(plans.items(), errors):
+        results[lang_code] = error if error is not None else join_translated(new_sentences, plan)
+    remember_translation(group_id, message_id, record["reply_message_id"], new_text, results)
+    return record["reply_message_id"], results
@@ -0,0 +1,94 @@
+# services/message_filter.py
+"""
+Local pre-filter in front of the translator.
+Messages with nothing to translate - only emoji, numbers, URLs, @mentions, bot commands, hashtags, code
+or punctuation - are recognized with a single regex pass and skipped without any backend call.
+In other messages, URLs, mentions, commands, hashtags and code spans are replaced by numbered
+placeholders before translation and put back afterwards, so the backend cannot alter them.
+"""
+
+import re
+
+_CODE = r"```.*?```|`[^`\n]+`"
+_URL = r"https?://\S+|www\.\S+"
+_MENTION = r"(?<!\w)@\w{2,}"
+_COMMAND = r"(?<![\w/])/[A-Za-z]\w*(?:@\w+)?"
+_HASHTAG = r"(?<!\w)#\w+"
+_MASK_RE = re.compile(
+    f"(?P<code>{_CODE})|(?P<url>{_URL})|(?P<mention>{_MENTION})|(?P<command>{_COMMAND})|(?P<hashtag>{_HASHTAG})",
+    re.S,
+)
+_LETTER_RE = re.compile(r"[^\W\d_]")
+_DIGIT_RE = re.compile(r"\d")
+# Symbols other than punctuation: emoji, pictographs, dingbats, ...
+_SYMBOL_RE = re.compile(r"[^\w\s!-/:-@\[-`{-~¡-¿‐-‧‰-⁞　-〿]")
+
+# Placeholder standing for a masked span; brackets and digits pass through translation unchanged
+PLACEHOLDER = "⟦{}⟧"
+_PLACEHOLDER_RE = re.compile(r"⟦\s*(\d+)\s*⟧")
+
+def untranslatable_reason(text: str) -> str | None:
+    """
+    Tells whether a message has nothing to translate, and why.
+    Args:
+        text (str): The message text.
+    Returns:
+        str | None: What the message consists of - code, url, mention, command, hashtag, number,
+            emoji or punctuation - or None if it contains words to translate.
+    """
+    first_kind = None
+    remainder = text
+    match = _MASK_RE.search(text)
+    if match is not None:
+        first_kind = match.lastgroup
+        remainder = _MASK_RE.sub(" ", text)
+    if _LETTER_RE.search(remainder):
+        return None
+    if first_kind is not None:
+        return first_kind
+    if _DIGIT_RE.search(remainder):
+        return "number"
+    if _SYMBOL_RE.search(remainder):
+        return "emoji"
+    return "punctuation"
+
+def mask_spans(text: str) -> tuple[str, list]:
+    """
+    Replaces URLs, mentions, commands, hashtags and code spans with numbered placeholders.
+    Args:
+        text (str): The message text.
+    Returns:
+        tuple[str, list]: The text to translate, and the original spans in placeholder order.
+    """
+    spans = []
+
+    def replace(match):
+        spans.append(match.group())
+        return PLACEHOLDER.format(len(spans))
+
+    return _MASK_RE.sub(replace, text), spans
+
+def restore_spans(translated_text: str, spans: list) -> str:
+    """
+    Puts the original spans back into a translation made from mask_spans() output.
+    Spans whose placeholder did not survive translation are appended at the end, so none are lost.
+    Args:
+        translated_text (str): The translated text.
+        spans (list): Original spans, as returned by mask_spans().
+    Returns:
+        str: The translation with the original spans.
+    """
+    if not spans:
+        return translated_text
+    restored = set()
+
+    def replace(match):
+        index = int(match.group(1)) - 1
+        if not 0 <= index < len(spans):
+            return match.group()
+        restored.add(index)
+        return spans[index]
+
+    result = _PLACEHOLDER_RE.sub(replace, translated_text)
+    missing = [span for index, span in enumerate(spans) if index not in restored]
+    return " ".join([result, *missing]) if missing else result
@@ -1,88 +1,439 @@
 # services/message_queue.py
-#TODO:connect to the project
+"""
+Per-group message queues and the micro-batching stage in front of the translator.
+Each group has a bounded asyncio queue drained by its own worker task, so messages of a group are
+translated and answered in order while different groups run in parallel.
+During bursts, a worker collects messages for a short window (or until a size cap is hit)
+and translates them together with one backend call per language, then splits the results back to each message.
+Messages with nothing to translate (emoji, numbers, links, ...) are answered without any backend call,
+and links, mentions and code are kept out of the translated text. Long messages skip the batch: they are translated in parallel chunks, and each language is delivered
+as soon as it is ready, so the first translations appear before the slowest language has finished.
+Workers stop after a period of inactivity and are started again by the next message.
+Under load, services/admission.py decides whether a message is admitted, merged into the sender's previous one,
+or has some of its languages deferred; deferred languages are translated once the load is gone and added to the reply.
+"""
 
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, deque
 
-from queue import Queue
-import threading
+from services import metrics
+from services.admission import admission, NORMAL, MERGE, REJECT, ADMISSION_DEFER_MAX_AGE
+from services.language_detection import detect_language
+from services.message_filter import untranslatable_reason, mask_spans, restore_spans
+from services.translator import translate_batch_to_language, translate_long_message
 
-# Global message queue: {group_id: Queue}
+# Seconds to wait for more messages from the same group before translating
+BATCH_WINDOW = float(os.getenv("MESSAGE_BATCH_WINDOW_MS", "150")) / 1000
+# Translate at most this many messages of a group together
+BATCH_MAX_SIZE = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "20"))
+# Maximum number of messages waiting per group
+QUEUE_MAX_DEPTH = int(os.getenv("MESSAGE_QUEUE_MAX_DEPTH", "100"))
+# What to do with a new message when its group's queue is full: drop_oldest, coalesce or reject
+QUEUE_OVERFLOW_POLICY = os.getenv("MESSAGE_QUEUE_OVERFLOW_POLICY", "drop_oldest")
+# Seconds a worker waits for new messages before shutting down
+WORKER_IDLE_TIMEOUT = float(os.getenv("MESSAGE_WORKER_IDLE_TIMEOUT", "60"))
+# Messages longer than this are translated in chunks and delivered language by language
+LONG_MESSAGE_CHARS = int(os.getenv("LONG_MESSAGE_CHARS", "1000"))
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "reject")
+if QUEUE_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"MESSAGE_QUEUE_OVERFLOW_POLICY must be one of {', '.join(OVERFLOW_POLICIES)}")
+
+class QueueFullError(Exception):
+    pass
+
+class OverloadedError(QueueFullError):
+    """
+    Raised when admission control refuses a message because the bot is overloaded.
+    """
+
+class GroupQueue(asyncio.Queue):
+    """
+    Bounded FIFO of pending messages for one group, with the extra operations the overflow policies need.
+    """
+
+    def drop_oldest(self) -> dict | None:
+        if self.empty():
+            return None
+        item = self.get_nowait()
+        self.task_done()
+        return item
+
+    def peek(self) -> list:
+        return list(self._queue)
+
+    def coalesce(self, sender, message_text, languages, on_dropped=None) -> bool:
+        # Only the newest message may absorb the new one, otherwise the group's order would change
+        if self.empty():
+            return False
+        last = self._queue[-1]
+        if last["sender"] != sender:
+            return False
+        last["message_text"] = f"{last['message_text']}\n{message_text}"
+        last["languages"] += [
+            lang_code for lang_code in languages
+            if lang_code not in last["languages"] and lang_code not in last["deferred"]
+        ]
+        # The merged message is finished when the one absorbing it is answered (or dropped)
+        if on_dropped is not None:
+            last["merged"].append(on_dropped)
+        return True
+
+# Queue and worker per group: {group_id: GroupQueue}, {group_id: asyncio.Task}
 message_queues = {}
-queue_lock = threading.Lock()  # Ensure thread-safe access to the queues
+_workers = {}
+# Messages affected by the overflow policy: dropped, coalesced, rejected
+overflow_counts = Counter()
+# Translated messages waiting for their deferred languages, oldest first, and the task translating them
+_deferred = deque()
+_deferred_worker = None
+# Seconds between load checks while deferred languages wait
+_DEFERRED_POLL_INTERVAL = 1.0
 
-def add_to_queue(group_id, sender, message_text) -> bool:
+def submit_message(group_id, sender, message_text, languages, on_result, on_progress=None, on_dropped=None) -> bool:
     """
-    Add a message to the queue for the specified group.
-    
+    Add a message to the queue for the specified group, starting the group's worker if needed.
+
     Args:
         group_id (str): The ID of the group.
         sender (str): The ID of the sender.
         message_text (str): The text of the message.
-    """
-    with queue_lock:  # Ensure thread-safe access to the queue dictionary
-        if group_id not in message_queues:
-            message_queues[group_id] = Queue()
-        
-        # Add the message to the group's queue
-        message_queues[group_id].put({
-            "sender": sender,
-            "message_text": message_text
-        })
-
-def get_from_queue(group_id) -> dict:
-    """
-    Get the next message from the queue for the specified group.
-    
-    Args:
-        group_id (str): The ID of the group.
-    
+        languages (list): Target language codes.
+        on_result (callable): Coroutine function called by the worker with the
+            {language code: translated text or exception} dict once the message is translated.
+        on_progress (callable): Optional coroutine function called with the languages finished so far
+            while a long message is still being translated, in the order they finished.
+        on_dropped (callable): Optional function called without arguments once the message will not be
+            answered on its own: when it is dropped by the overflow policy before it is translated, or,
+            if it was merged into the sender's previous message, once that message is answered or dropped.
+
     Returns:
-        dict: The next message in the group's queue, or None if the queue is empty.
+        bool: True if the message was queued, False if it was merged into the previous message of the same sender.
+
+    Raises:
+        QueueFullError: If the queue is full and the overflow policy is "reject".
+        OverloadedError: If admission control refuses the message.
     """
-    with queue_lock:  # Ensure thread-safe access to the queue dictionary
-        if group_id in message_queues and not message_queues[group_id].empty():
-            return message_queues[group_id].get()
-        return None
+    queue = message_queues.get(group_id)
+    if queue is None:
+        queue = message_queues[group_id] = GroupQueue(maxsize=QUEUE_MAX_DEPTH)
+
+    level = admission.update(get_total_queue_size())
+    if level >= REJECT and not queue.empty():
+        metrics.increment("admission_actions_total", action="rejected")
+        raise OverloadedError(f"Bot is overloaded, refused a message for group {group_id}")
+    if level >= MERGE and queue.coalesce(sender, message_text, languages, on_dropped):
+        metrics.increment("admission_actions_total", action="merged")
+        return False
+    # Deferred languages are shown by updating the reply, which needs on_progress
+    deferred = []
+    if on_progress is not None:
+        languages, deferred = admission.split_languages(group_id, languages)
+        if deferred:
+            metrics.increment("admission_actions_total", action="deferred")
+
+    if queue.full():
+        if QUEUE_OVERFLOW_POLICY == "reject":
+            overflow_counts["rejected"] += 1
+            raise QueueFullError(f"Message queue for group {group_id} is full")
+        if QUEUE_OVERFLOW_POLICY == "coalesce" and queue.coalesce(sender, message_text, languages, on_dropped):
+            overflow_counts["coalesced"] += 1
+            return False
+        dropped = queue.drop_oldest()
+        if dropped is not None:
+            for callback in (dropped["on_dropped"], *dropped["merged"]):
+                if callback is not None:
+                    callback()
+        overflow_counts["dropped"] += 1
+        logging.warning(f"Message queue for group {group_id} is full, dropped the oldest message")
+
+    queue.put_nowait({
+        "sender": sender,
+        "message_text": message_text,
+        "languages": list(languages),
+        "deferred": deferred,
+        "on_result": on_result,
+        "on_progress": on_progress,
+        "on_dropped": on_dropped,
+        # on_dropped callbacks of the messages merged into this one
+        "merged": [],
+    })
+    worker = _workers.get(group_id)
+    if worker is None or worker.done():
+        _workers[group_id] = asyncio.create_task(_run_worker(group_id, queue))
+    return True
 
 def get_queue_size(group_id) -> int:
     """
     Get the size of the queue for the specified group.
-    
+
     Args:
         group_id (str): The ID of the group.
-    
+
     Returns:
         int: The number of messages in the group's queue.
     """
-    with queue_lock:  # Ensure thread-safe access to the queue dictionary
-        if group_id in message_queues:
-            return message_queues[group_id].qsize()
-        return 0
+    queue = message_queues.get(group_id)
+    return queue.qsize() if queue is not None else 0
+
+def get_total_queue_size() -> int:
+    """
+    Get the number of messages waiting across all groups.
+
+    Returns:
+        int: The total number of queued messages.
+    """
+    return sum(queue.qsize() for queue in message_queues.values())
 
 def clear_queue(group_id) -> bool:
     """
-    Clear the queue for the specified group.
-    
+    Clear the queue for the specified group and stop its worker.
+
     Args:
         group_id (str): The ID of the group.
     """
-    with queue_lock:  # Ensure thread-safe access to the queue dictionary
-        if group_id in message_queues:
-            message_queues[group_id].queue.clear()  # Clear the queue
-            del message_queues[group_id]  # Remove the queue from the dictionary
-            return True
-    return False
+    queue = message_queues.pop(group_id, None)
+    worker = _workers.pop(group_id, None)
+    if worker is not None:
+        worker.cancel()
+    return queue is not None
 
 def peek_all_messages(group_id) -> list:
     """
     Peek at all messages in the queue for the specified group without removing them.
-    
+
     Args:
         group_id (str): The ID of the group.
-    
+
     Returns:
         list: A list of messages in the group's queue.
     """
-    with queue_lock:  # Ensure thread-safe access to the queue dictionary
-        if group_id in message_queues:
-            return list(message_queues[group_id].queue)
-        return []
\ No newline at end of file
+    queue = message_queues.get(group_id)
+    return queue.peek() if queue is not None else []
+
+metrics.describe("translator_targets_skipped_total", "Target languages skipped without a backend call, by reason")
+metrics.describe("message_batches_total", "Batches translated by the group workers")
+metrics.describe("message_batched_messages_total", "Messages translated by the group workers")
+metrics.register_callback(
+    "message_queue_depth",
+    get_total_queue_size,
+    description="Messages waiting for translation across all groups",
+)
+metrics.register_callback(
+    "message_queue_max_group_depth",
+    lambda: max((queue.qsize() for queue in message_queues.values()), default=0),
+    description="Depth of the longest group queue",
+)
+metrics.register_callback(
+    "message_queue_deferred_messages",
+    lambda: len(_deferred),
+    description="Translated messages waiting for their deferred languages",
+)
+metrics.register_callback(
+    "message_queue_workers",
+    lambda: len(_workers),
+    description="Running group workers",
+)
+metrics.register_callback(
+    "message_queue_overflow_total",
+    lambda: {(("action", action),): count for action, count in overflow_counts.items()},
+    kind="counter",
+    description="Messages dropped, coalesced or rejected by the overflow policy",
+)
+
+async def _next_batch(queue) -> list:
+    batch = [await asyncio.wait_for(queue.get(), WORKER_IDLE_TIMEOUT)]
+    deadline = asyncio.get_running_loop().time() + BATCH_WINDOW
+    while len(batch) < BATCH_MAX_SIZE:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def _run_worker(group_id, queue):
+    try:
+        while True:
+            try:
+                batch = await _next_batch(queue)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    break
+                continue
+            metrics.increment("message_batches_total")
+            metrics.increment("message_batched_messages_total", len(batch))
+            try:
+                await _process_batch(batch)
+            except Exception:
+                logging.exception(f"Batch translation failed for group {group_id}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+    finally:
+        if _workers.get(group_id) is asyncio.current_task():
+            del _workers[group_id]
+            if queue.empty() and message_queues.get(group_id) is queue:
+                del message_queues[group_id]
+
+def _restore(item, translated_text):
+    if isinstance(translated_text, Exception):
+        return translated_text
+    return restore_spans(translated_text, item["spans"])
+
+async def _process_batch(batch):
+    # Messages with nothing to translate get no targets. The others have links, mentions and code masked,
+    # and their language is detected locally: targets in that language are skipped,
+    # and the backend is told the source instead of detecting it
+    skipped = Counter()
+    for item in batch:
+        reason = untranslatable_reason(item["message_text"])
+        if reason is not None:
+            item["text"], item["spans"], item["source"], item["targets"] = item["message_text"], [], "auto", []
+            skipped[reason] += len(item["languages"]) + len(item["deferred"])
+            item["deferred"] = []
+            continue
+        item["text"], item["spans"] = mask_spans(item["message_text"])
+        source = detect_language(item["text"])
+        item["source"] = source or "auto"
+        item["targets"] = [lang_code for lang_code in item["languages"] if lang_code != source]
+        skipped["same_language"] += len(item["languages"]) - len(item["targets"])
+        deferred = [lang_code for lang_code in item["deferred"] if lang_code != source]
+        skipped["same_language"] += len(item["deferred"]) - len(deferred)
+        item["deferred"] = deferred
+    for reason, count in skipped.items():
+        if count:
+            metrics.increment("translator_targets_skipped_total", count, reason=reason)
+
+    # Long messages start translating right away, every language on its own
+    streams = {}
+    for item in batch:
+        if len(item["text"]) > LONG_MESSAGE_CHARS:
+            streams[id(item)] = {
+                asyncio.create_task(translate_long_message(item["text"], lang_code, source=item["source"])): lang_code
+                for lang_code in item["targets"]
+            }
+
+    # One backend call per target language, covering every other message that needs it.
+    # The source is passed explicitly when all of those messages share it.
+    items_per_language = {}
+    for item in batch:
+        if id(item) in streams:
+            continue
+        for lang_code in item["targets"]:
+            items_per_language.setdefault(lang_code, []).append(item)
+
+    requests = []
+    for lang_code, items in items_per_language.items():
+        sources = {item["source"] for item in items}
+        source = sources.pop() if len(sources) == 1 else "auto"
+        requests.append(translate_batch_to_language([item["text"] for item in items], lang_code, source=source))
+    start = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(*requests)
+        if requests:
+            admission.observe_latency(time.perf_counter() - start)
+    except BaseException:
+        for tasks in streams.values():
+            for task in tasks:
+                task.cancel()
+        raise
+
+    translations = {}
+    for (lang_code, items), translated in zip(items_per_language.items(), outcomes):
+        for item, translated_text in zip(items, translated):
+            translations[(id(item), lang_code)] = _restore(item, translated_text)
+
+    # Deliver in arrival order so replies within a group stay ordered
+    for item in batch:
+        try:
+            if id(item) in streams:
+                await _deliver_stream(item, streams[id(item)])
+                continue
+            results = {lang_code: translations[(id(item), lang_code)] for lang_code in item["targets"]}
+            await _finish(item, results)
+        except Exception:
+            logging.exception("Delivering translations failed")
+
+async def _deliver_stream(item, tasks: dict):
+    # Languages that finish together are delivered together, in completion order
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: item["targets"].index(tasks[task])):
+                results[tasks[task]] = task.exception() or _restore(item, task.result())
+            if pending and item["on_progress"] is not None:
+                await item["on_progress"](dict(results))
+    finally:
+        for task in pending:
+            task.cancel()
+    await _finish(item, results)
+
+async def _finish(item, results: dict):
+    # Messages with deferred languages show what is ready now and are completed later
+    if not item["deferred"]:
+        await _answer(item, results)
+        return
+    if results:
+        await item["on_progress"](dict(results))
+    item["results"] = results
+    item["deferred_at"] = time.monotonic()
+    _deferred.append(item)
+    global _deferred_worker
+    if _deferred_worker is None or _deferred_worker.done():
+        _deferred_worker = asyncio.create_task(_run_deferred_worker())
+
+async def _answer(item, results: dict):
+    await item["on_result"](results)
+    # Only once the answer went out, so messages merged into this one are not lost if it fails
+    for callback in item["merged"]:
+        callback()
+
+async def _run_deferred_worker():
+    # Deferred languages are translated one message at a time, and only while the load is normal
+    while _deferred:
+        await _expire_deferred()
+        if admission.update(get_total_queue_size()) > NORMAL:
+            await asyncio.sleep(_DEFERRED_POLL_INTERVAL)
+            continue
+        if not _deferred:
+            break
+        item = _deferred.popleft()
+        try:
+            item["results"].update(await _translate_deferred(item))
+            await _answer(item, item["results"])
+        except Exception:
+            logging.exception("Translating deferred languages failed")
+
+async def _expire_deferred():
+    # Messages that waited too long are answered with the languages they have
+    now = time.monotonic()
+    while _deferred and now - _deferred[0]["deferred_at"] > ADMISSION_DEFER_MAX_AGE:
+        item = _deferred.popleft()
+        metrics.increment("admission_actions_total", action="expired")
+        try:
+            await _answer(item, item["results"])
+        except Exception:
+            logging.exception("Delivering translations failed")
+
+async def _translate_deferred(item) -> dict:
+    async def translate(lang_code):
+        if len(item["text"]) > LONG_MESSAGE_CHARS:
+            return await translate_long_message(item["text"], lang_code, source=item["source"])
+        translated_text = (await translate_batch_to_language([item["text"]], lang_code, source=item["source"]))[0]
+        if isinstance(translated_text, Exception):
+            raise translated_text
+        return translated_text
+
+    outcomes = await asyncio.gather(*(translate(lang_code) for lang_code in item["deferred"]), return_exceptions=True)
+    return {lang_code: _restore(item, outcome) for lang_code, outcome in zip(item["deferred"], outcomes)}
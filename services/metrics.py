@@ -0,0 +1,225 @@
+# services/metrics.py
+"""
+Lightweight in-process metrics for the bot's hot path.
+Counters and latency histograms are recorded by the services and handlers, gauges are read on demand
+from callbacks, and everything is exposed in the Prometheus text format on a local HTTP endpoint.
+An optional periodic log line summarizes the same numbers.
+
+Recording is a dict lookup, a bisect and a few additions under a lock, so it is cheap enough for every message.
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Port of the /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Seconds between metric summaries in the log; 0 disables them
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+
+# Latency buckets in seconds, covering cache hits up to slow translator calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# {name: {labels: value}}
+_counters = {}
+# {name: {labels: [bucket counts..., +Inf count, sum]}}
+_histograms = {}
+# {name: (kind, callable returning a number or {labels: number})}
+_callbacks = {}
+_help = {}
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def increment(name: str, amount: float = 1, **labels):
+    """
+    Adds to a counter.
+    Args:
+        name (str): Metric name.
+        amount (float): Amount to add.
+        **labels: Label values identifying the series.
+    """
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Records a duration in a latency histogram.
+    Args:
+        name (str): Metric name.
+        seconds (float): Observed duration.
+        **labels: Label values identifying the series.
+    """
+    key = _label_key(labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        buckets = series.get(key)
+        if buckets is None:
+            buckets = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        buckets[index] += 1
+        buckets[-1] += seconds
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Context manager recording the duration of its block in a histogram.
+    Args:
+        name (str): Metric name.
+        **labels: Label values identifying the series.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def register_callback(name: str, callback, kind: str = "gauge", description: str = ""):
+    """
+    Registers a metric whose value is read from a callback when metrics are collected,
+    for values the services already track themselves (queue depths, cache counters).
+    Args:
+        name (str): Metric name.
+        callback (callable): Returns a number, or a {((label, value), ...): number} mapping.
+        kind (str): Prometheus type: gauge or counter.
+        description (str): Help text.
+    """
+    _callbacks[name] = (kind, callback)
+    if description:
+        _help[name] = description
+
+def describe(name: str, description: str):
+    _help[name] = description
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+def render_prometheus() -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format.
+    Returns:
+        str: The metrics page.
+    """
+    lines = []
+    with _lock:
+        counters = {name: dict(series) for name, series in _counters.items()}
+        histograms = {name: {key: list(buckets) for key, buckets in series.items()} for name, series in _histograms.items()}
+
+    for name, series in sorted(counters.items()):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(key)} {value:g}")
+
+    for name, series in sorted(histograms.items()):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, buckets in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+            cumulative += buckets[len(LATENCY_BUCKETS)]
+            lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {buckets[-1]:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+
+    for name, (kind, callback) in sorted(_callbacks.items()):
+        try:
+            value = callback()
+        except Exception as e:
+            logging.warning(f"Reading metric {name} failed: {e}")
+            continue
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+        if isinstance(value, dict):
+            for key, series_value in sorted(value.items()):
+                lines.append(f"{name}{_format_labels(key)} {series_value:g}")
+        else:
+            lines.append(f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+def summarize() -> str:
+    """
+    Returns a one-line summary of counters and of the mean of each histogram, for logging.
+    """
+    parts = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            parts.append(f"{name}={sum(series.values()):g}")
+        for name, series in sorted(_histograms.items()):
+            count = sum(sum(buckets[:-1]) for buckets in series.values())
+            total = sum(buckets[-1] for buckets in series.values())
+            if count:
+                parts.append(f"{name}_avg_ms={total / count * 1000:.1f}(n={count})")
+    for name, (kind, callback) in sorted(_callbacks.items()):
+        try:
+            value = callback()
+        except Exception:
+            continue
+        parts.append(f"{name}={sum(value.values()) if isinstance(value, dict) else value:g}")
+    return " ".join(parts)
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Drain the headers; the request body is never needed
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str | None = None, port: int | None = None):
+    """
+    Starts the /metrics HTTP endpoint on the running event loop.
+    Args:
+        host (str | None): Interface to listen on. Defaults to METRICS_HOST.
+        port (int | None): Port to listen on; 0 disables the endpoint. Defaults to METRICS_PORT.
+    Returns:
+        asyncio.Server | None: The server, or None if disabled.
+    """
+    host = METRICS_HOST if host is None else host
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_request, host, port)
+    logging.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
+
+async def log_metrics_periodically(interval: float = METRICS_LOG_INTERVAL):
+    """
+    Logs a metrics summary every `interval` seconds until cancelled.
+    """
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"Metrics: {summarize()}")
@@ -0,0 +1,158 @@
+# services/outbox.py
+"""
+Durable record of accepted group messages whose translations have not been sent yet, so a restart or crash
+does not lose them. Each message is written to the outbox when it is accepted and removed once its
+translations are sent; on startup, whatever is still there is translated and sent again.
+
+The outbox is its own SQLite file in WAL mode with full fsync, written by a dedicated thread.
+Writes are group-committed: appends and removals made within OUTBOX_FLUSH_MS of each other share one
+transaction and one fsync, and a message that is done before its append was flushed is never written at all.
+Handlers do not wait for the write, so the outbox adds no latency to the reply.
+Delivery is at least once: a message whose reply was sent just before a crash can be answered twice.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from services import metrics
+
+# Path of the outbox database; kept apart from the main database so its fsyncs do not slow other writes
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+# Window in which outbox writes are collected into one transaction
+OUTBOX_FLUSH_MS = float(os.getenv("OUTBOX_FLUSH_MS", "20"))
+# Unfinished messages older than this (seconds) are dropped instead of replayed
+OUTBOX_MAX_AGE = float(os.getenv("OUTBOX_MAX_AGE", "3600"))
+
+class Outbox:
+    """
+    Group-committed SQLite outbox of pending messages. append() and complete() are called from the event loop;
+    all database work runs on the outbox's own thread.
+    """
+
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        # Writes waiting for the next flush: {entry_id: (group_id, payload, created_at)} and {entry_id}
+        self._appends = {}
+        self._completions = set()
+        self._flusher = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # FULL: a committed batch survives power loss, not just a process crash
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    entry_id TEXT PRIMARY KEY,
+                    group_id TEXT,
+                    payload TEXT,
+                    created_at REAL
+                );
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def append(self, group_id: str, payload: dict) -> str:
+        """
+        Records an accepted message. Returns at once; the write is flushed with the next batch.
+        Args:
+            group_id (str): Telegram group identifier.
+            payload (dict): JSON-serializable message, e.g. telegram.Message.to_dict().
+        Returns:
+            str: The entry id, to pass to complete() once the message is answered.
+        """
+        entry_id = uuid.uuid4().hex
+        self._appends[entry_id] = (group_id, json.dumps(payload), time.time())
+        self._schedule_flush()
+        return entry_id
+
+    def complete(self, entry_id: str | None):
+        """
+        Removes a message from the outbox once its translations are sent, or it was dropped on purpose.
+        """
+        if entry_id is None:
+            return
+        # Finished before it was ever written: nothing to write at all
+        if self._appends.pop(entry_id, None) is None:
+            self._completions.add(entry_id)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Writes made while a flush is running find this task still running and do not schedule another,
+        # so it keeps flushing until nothing is left
+        while self._appends or self._completions:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes all pending appends and removals in one transaction.
+        """
+        appends, self._appends = self._appends, {}
+        completions, self._completions = self._completions, set()
+        if not appends and not completions:
+            return
+        start = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, appends, completions)
+        except Exception:
+            logging.exception("Writing the outbox failed")
+            # Kept for the next flush
+            for entry_id, entry in appends.items():
+                self._appends.setdefault(entry_id, entry)
+            self._completions |= completions
+            return
+        metrics.observe("outbox_flush_seconds", time.perf_counter() - start)
+        metrics.increment("outbox_writes_total", len(appends) + len(completions))
+
+    def _write(self, appends: dict, completions: set):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO outbox (entry_id, group_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                [(entry_id, *entry) for entry_id, entry in appends.items()],
+            )
+            conn.executemany("DELETE FROM outbox WHERE entry_id = ?", [(entry_id,) for entry_id in completions])
+
+    def _read_pending(self, max_age: float) -> list:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM outbox WHERE created_at < ?", (time.time() - max_age,))
+        rows = conn.execute("SELECT entry_id, group_id, payload FROM outbox ORDER BY created_at").fetchall()
+        return [(entry_id, group_id, json.loads(payload)) for entry_id, group_id, payload in rows]
+
+    async def pending(self, max_age: float = OUTBOX_MAX_AGE) -> list:
+        """
+        Returns the messages left unfinished by a previous run, oldest first. Older ones are discarded.
+        Returns:
+            list: (entry_id, group_id, payload) tuples.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._read_pending, max_age)
+
+    def size(self) -> int:
+        return len(self._appends) + len(self._completions)
+
+outbox = Outbox(OUTBOX_PATH, OUTBOX_FLUSH_MS / 1000)
+
+metrics.describe("outbox_flush_seconds", "Duration of outbox group commits")
+metrics.describe("outbox_writes_total", "Outbox appends and removals written to disk")
+metrics.describe("outbox_replayed_total", "Unfinished messages replayed from the outbox at startup")
+metrics.register_callback(
+    "outbox_unflushed_writes",
+    outbox.size,
+    description="Outbox writes waiting for the next group commit",
+)
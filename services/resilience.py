@@ -0,0 +1,301 @@
+# services/resilience.py
+"""
+Resilience layer between the translator and its backends, so a degraded upstream costs bounded latency
+instead of failed or stalled replies:
+- Every attempt has its own deadline, and failed attempts are retried with jittered exponential backoff.
+- Each backend has a circuit breaker: after repeated failures it is skipped for a while, then tried again
+  with a single request.
+- When an attempt takes longer than the backend's recent latency percentile, a duplicate (hedged) request
+  is sent and whichever answers first wins.
+- When a backend is exhausted or its breaker is open, the next backend in TRANSLATION_FALLBACK_BACKENDS
+  takes over.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from services import metrics
+from services.backends import TranslationBackend, create_backend
+
+# Backends tried in order when the main one fails, comma-separated (e.g. "fake"); empty for none
+TRANSLATION_FALLBACK_BACKENDS = [name.strip() for name in os.getenv("TRANSLATION_FALLBACK_BACKENDS", "").split(",") if name.strip()]
+# Attempts per backend before failing over to the next one
+TRANSLATION_ATTEMPTS = int(os.getenv("TRANSLATION_ATTEMPTS", "3"))
+# Seconds a single attempt may take; the translator's TRANSLATION_TIMEOUT still bounds all attempts together
+TRANSLATION_ATTEMPT_TIMEOUT = float(os.getenv("TRANSLATION_ATTEMPT_TIMEOUT", "4"))
+# Base of the exponential backoff between attempts, in seconds
+TRANSLATION_RETRY_DELAY = float(os.getenv("TRANSLATION_RETRY_DELAY", "0.2"))
+# Latency percentile of a backend after which a hedged request is sent; 0 disables hedging
+TRANSLATION_HEDGE_PERCENTILE = float(os.getenv("TRANSLATION_HEDGE_PERCENTILE", "0.95"))
+# Consecutive failures that open a backend's circuit breaker, and seconds it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Latencies kept per backend, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+# Longest backoff between attempts, in seconds
+MAX_RETRY_DELAY = 2.0
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_seconds`.
+    Afterwards a single trial call is let through: its success closes the breaker, its failure opens it again.
+    Safe to use from the event loop and from translation worker threads.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        # The trial call was abandoned (cancelled) without an outcome; the next call may try again
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+class LatencyTracker:
+    """
+    Recent successful latencies of a backend, for percentile-based hedging.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> float | None:
+        """
+        Returns the latency below which `fraction` of recent calls finished, or None with too few samples.
+        """
+        with self._lock:
+            if len(self._samples) < LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class _BackendState:
+    def __init__(self, backend: TranslationBackend):
+        self.backend = backend
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        self.latencies = LatencyTracker()
+
+class ResilientBackend(TranslationBackend):
+    """
+    Wraps a main backend and its fallbacks with deadlines, retries, circuit breakers and hedged requests.
+    See the module docstring. Errors the backend marks as permanent (e.g. an unsupported language)
+    are raised at once, without retrying or failing over.
+    """
+
+    def __init__(
+        self,
+        backends: list,
+        attempts: int = TRANSLATION_ATTEMPTS,
+        attempt_timeout: float = TRANSLATION_ATTEMPT_TIMEOUT,
+        retry_delay: float = TRANSLATION_RETRY_DELAY,
+        hedge_percentile: float = TRANSLATION_HEDGE_PERCENTILE,
+    ):
+        self.name = "+".join(backend.name for backend in backends)
+        self.max_request_chars = min(backend.max_request_chars for backend in backends)
+        self.attempts = max(1, attempts)
+        self.attempt_timeout = attempt_timeout
+        self.retry_delay = retry_delay
+        self.hedge_percentile = hedge_percentile
+        self._states = [_BackendState(backend) for backend in backends]
+
+    @property
+    def backends(self) -> list:
+        return [state.backend for state in self._states]
+
+    @property
+    def calls(self) -> int:
+        # Requests made to the wrapped backends that count them (FakeBackend), retries and hedges included
+        return sum(getattr(state.backend, "calls", 0) for state in self._states)
+
+    def translate(self, text: str, target: str, source: str = "auto") -> str:
+        return self._run_sync(lambda backend: backend.translate(text, target, source))
+
+    def translate_batch(self, texts: list, target: str, source: str = "auto") -> list:
+        return self._run_sync(lambda backend: _check_batch(backend.translate_batch(texts, target, source)))
+
+    async def translate_async(self, text: str, target: str, source: str = "auto") -> str:
+        return await self._run_async(lambda backend: backend.translate_async(text, target, source))
+
+    async def translate_batch_async(self, texts: list, target: str, source: str = "auto") -> list:
+        async def call(backend):
+            return _check_batch(await backend.translate_batch_async(texts, target, source))
+        return await self._run_async(call)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter, so retries from concurrent callers do not arrive in lockstep
+        return random.uniform(0, min(MAX_RETRY_DELAY, self.retry_delay * 2 ** attempt))
+
+    async def _run_async(self, call):
+        last_error = None
+        for position, state in enumerate(self._states):
+            if position:
+                metrics.increment("translator_failovers_total", backend=state.backend.name)
+            for attempt in range(self.attempts):
+                # Every thread is held by abandoned requests: a retry would only queue behind them
+                if attempt and state.backend.saturated:
+                    break
+                if not state.breaker.allow():
+                    metrics.increment("translator_breaker_rejections_total", backend=state.backend.name)
+                    last_error = last_error or CircuitOpenError(f"{state.backend.name} backend unavailable")
+                    break
+                if attempt:
+                    metrics.increment("translator_retries_total", backend=state.backend.name)
+                try:
+                    result = await self._hedged(state, call)
+                except state.backend.permanent_errors:
+                    state.breaker.record_success()
+                    raise
+                except Exception as e:
+                    state.breaker.record_failure()
+                    last_error = e
+                    if attempt + 1 < self.attempts:
+                        await asyncio.sleep(self._backoff(attempt))
+                    continue
+                except BaseException:
+                    # Cancelled (e.g. by a caller's timeout): a half-open breaker must not wait for this trial forever
+                    state.breaker.release_trial()
+                    raise
+                state.breaker.record_success()
+                return result
+        raise last_error
+
+    async def _hedged(self, state: _BackendState, call):
+        # One attempt: a request, plus a duplicate if it is slower than the backend usually is
+        async def timed():
+            start = time.monotonic()
+            result = await call(state.backend)
+            state.latencies.add(time.monotonic() - start)
+            return result
+
+        start = time.monotonic()
+        deadline = start + self.attempt_timeout
+        hedge_after = state.latencies.percentile(self.hedge_percentile) if self.hedge_percentile > 0 else None
+        hedged = hedge_after is None
+        pending = {asyncio.ensure_future(timed())}
+        error = None
+        try:
+            while pending:
+                wait_until = deadline if hedged else min(deadline, start + hedge_after)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, wait_until - time.monotonic()), return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not done:
+                    if hedged or time.monotonic() >= deadline:
+                        raise TimeoutError(f"{state.backend.name} backend timed out after {self.attempt_timeout:g}s")
+                    hedged = True
+                    # A hedge on a saturated backend would wait for a thread rather than race the request
+                    if not state.backend.saturated:
+                        metrics.increment("translator_hedges_total", backend=state.backend.name)
+                        pending.add(asyncio.ensure_future(timed()))
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _run_sync(self, call):
+        # Blocking variant for worker threads: retries and failover, without hedging or deadlines
+        last_error = None
+        for position, state in enumerate(self._states):
+            if position:
+                metrics.increment("translator_failovers_total", backend=state.backend.name)
+            for attempt in range(self.attempts):
+                if not state.breaker.allow():
+                    metrics.increment("translator_breaker_rejections_total", backend=state.backend.name)
+                    last_error = last_error or CircuitOpenError(f"{state.backend.name} backend unavailable")
+                    break
+                if attempt:
+                    metrics.increment("translator_retries_total", backend=state.backend.name)
+                try:
+                    result = call(state.backend)
+                except state.backend.permanent_errors:
+                    state.breaker.record_success()
+                    raise
+                except Exception as e:
+                    state.breaker.record_failure()
+                    last_error = e
+                    if attempt + 1 < self.attempts:
+                        time.sleep(self._backoff(attempt))
+                    continue
+                state.breaker.record_success()
+                return result
+        raise last_error
+
+    def breaker_states(self) -> dict:
+        return {(("backend", state.backend.name),): int(state.breaker.is_open) for state in self._states}
+
+def _check_batch(results: list) -> list:
+    # A batch where every text failed is a failed request, worth retrying or failing over
+    if results and all(isinstance(result, Exception) for result in results):
+        raise results[0]
+    return results
+
+def create_resilient_backend(name: str, fallbacks: list | None = None) -> ResilientBackend:
+    """
+    Creates a backend by name, wrapped with its fallbacks in a ResilientBackend.
+    Args:
+        name (str): Main backend name: google or fake.
+        fallbacks (list | None): Fallback backend names, in order. Defaults to TRANSLATION_FALLBACK_BACKENDS.
+    Returns:
+        ResilientBackend: The wrapped backend.
+    """
+    fallbacks = TRANSLATION_FALLBACK_BACKENDS if fallbacks is None else fallbacks
+    backend = ResilientBackend([create_backend(backend_name) for backend_name in [name, *fallbacks]])
+    metrics.register_callback(
+        "translator_breaker_open",
+        backend.breaker_states,
+        description="1 while a translation backend's circuit breaker is open",
+    )
+    return backend
+
+metrics.describe("translator_retries_total", "Retried translation backend attempts, by backend")
+metrics.describe("translator_hedges_total", "Hedged duplicate translation requests, by backend")
+metrics.describe("translator_failovers_total", "Translations handed to a fallback backend, by backend")
+metrics.describe("translator_breaker_rejections_total", "Translations skipping a backend because its breaker was open")
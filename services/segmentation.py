@@ -0,0 +1,92 @@
+# services/segmentation.py
+"""
+Splits messages into sentences so they can be diffed, cached and translated piece by piece.
+Segments keep their trailing whitespace, so joining them gives back the original text exactly.
+"""
+
+import re
+
+# A sentence ends at terminal punctuation followed by whitespace (or the end), or at a line break
+_SENTENCE_END_RE = re.compile(r"[.!?…。！？]+[\"')\]»”’]*(?=\s|$)|\n")
+_TRAILING_SPACE_RE = re.compile(r"\s*")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Splits text into sentences.
+    Args:
+        text (str): Text to split.
+    Returns:
+        list[str]: The sentences, each with its trailing whitespace; "".join() of the result equals `text`.
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = _TRAILING_SPACE_RE.match(text, match.end()).end()
+        if end <= start:
+            continue
+        sentences.append(text[start:end])
+        start = end
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+def split_segments(text: str, max_chars: int) -> list[str]:
+    """
+    Splits text into sentences, breaking sentences longer than max_chars at whitespace
+    (or anywhere, if a run of text has no whitespace).
+    Args:
+        text (str): Text to split.
+        max_chars (int): Longest segment allowed.
+    Returns:
+        list[str]: Segments of at most max_chars characters; "".join() of the result equals `text`.
+    """
+    segments = []
+    for sentence in split_sentences(text):
+        while len(sentence) > max_chars:
+            cut = max_chars
+            for match in _WHITESPACE_RE.finditer(sentence, 0, max_chars):
+                cut = match.end()
+            segments.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if sentence:
+            segments.append(sentence)
+    return segments
+
+def pack_segments(segments: list[str], max_chars: int) -> list[list[int]]:
+    """
+    Groups consecutive segments into chunks of at most max_chars characters.
+    Args:
+        segments (list[str]): Segments as returned by split_segments().
+        max_chars (int): Largest chunk size; a longer segment gets a chunk of its own.
+    Returns:
+        list[list[int]]: Indexes of the segments in each chunk, in order.
+    """
+    chunks = []
+    current = []
+    current_length = 0
+    for index, segment in enumerate(segments):
+        if current and current_length + len(segment) > max_chars:
+            chunks.append(current)
+            current = []
+            current_length = 0
+        current.append(index)
+        current_length += len(segment)
+    if current:
+        chunks.append(current)
+    return chunks
+
+def join_translated(sentences: list[str], translations: list[str]) -> str:
+    """
+    Joins translated sentences, reusing the whitespace that followed each source sentence.
+    Args:
+        sentences (list[str]): Source sentences as returned by split_sentences().
+        translations (list[str]): Translation of each sentence, in the same order.
+    Returns:
+        str: The joined translation.
+    """
+    parts = []
+    for sentence, translated in zip(sentences, translations):
+        separator = sentence[len(sentence.rstrip()):] or " "
+        parts.append(translated.strip() + separator)
+    return "".join(parts).strip()
@@ -0,0 +1,292 @@
+# services/send_scheduler.py
+"""
+Central scheduler for everything the bot sends to Telegram.
+Telegram limits bots to about 30 messages per second overall, one per second in a private chat and
+20 per minute in a group, and answers sends over the limit with a flood-wait (RetryAfter) error.
+Every send therefore goes through this scheduler:
+- Each chat has a queue drained by its own task, paced by a per-chat token bucket.
+- A global token bucket is shared by all chats and hands out tokens by priority, so translations
+  go out ahead of welcome and help messages when the bot is at its limit.
+- Queued sends are coalesced: a newer edit of the same message replaces the queued one, and
+  mergeable texts for the same chat are combined into one message.
+- A flood-wait pauses the chat for the time Telegram asks for, and the send is retried.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+
+from services import metrics
+
+# Messages per second across all chats; 0 disables the limit
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+# Messages per second in a private chat; 0 disables the limit
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+# Messages per minute in a group; 0 disables the limit
+SEND_GROUP_RATE_PER_MINUTE = float(os.getenv("SEND_GROUP_RATE_PER_MINUTE", "20"))
+# Messages a chat may send back to back before its rate applies
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+# Attempts per send when Telegram answers with a flood-wait
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+
+# Priority classes, most urgent first
+PRIORITY_TRANSLATION = 0
+PRIORITY_REPLY = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_TRANSLATION: "translation", PRIORITY_REPLY: "reply", PRIORITY_BACKGROUND: "background"}
+
+# Longest message Telegram accepts, for everything the bot sends; merged texts stay within it
+MESSAGE_LIMIT = 4096
+# Token buckets of idle chats kept before the refilled ones are dropped
+IDLE_BUCKETS_SWEEP = 1000
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average and bursts of up to `capacity`. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """
+        Returns the seconds until a token is available.
+        """
+        now = time.monotonic()
+        blocked = max(0.0, self.blocked_until - now)
+        if self.rate <= 0:
+            return blocked
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(blocked, (1 - self.tokens) / self.rate)
+
+    def refill_delay(self) -> float:
+        """
+        Returns the seconds until the bucket is full and unblocked again, from when on a new bucket behaves the same.
+        """
+        now = time.monotonic()
+        blocked = max(0.0, self.blocked_until - now)
+        if self.rate <= 0:
+            return blocked
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(blocked, (self.capacity - self.tokens) / self.rate)
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def block(self, seconds: float):
+        """
+        Hands out no tokens for the given time, e.g. after a flood-wait.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def _chat_bucket(chat_id: str) -> TokenBucket:
+    # Group and channel ids are negative
+    if chat_id.startswith("-"):
+        return TokenBucket(SEND_GROUP_RATE_PER_MINUTE / 60, SEND_CHAT_BURST)
+    return TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+
+class SendScheduler:
+    """
+    Queues, paces and retries outgoing Telegram requests. See the module docstring.
+    """
+
+    def __init__(self, global_rate: float):
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._sequence = itertools.count()
+        # Per chat: pending sends as a heap of (priority, sequence, item), the chat's token bucket and its task
+        self._queues = {}
+        self._buckets = {}
+        self._workers = {}
+        # Number of buckets at which idle ones are next swept
+        self._sweep_at = IDLE_BUCKETS_SWEEP
+        # Chat tasks waiting for a global token: heap of (priority, sequence, future)
+        self._global_waiters = []
+        self._global_dispatcher = None
+
+    def submit(
+        self, chat_id, call, /, priority: int = PRIORITY_TRANSLATION, coalesce_key=None, merge: bool = False,
+        kind: str | None = None, **kwargs,
+    ) -> asyncio.Future:
+        """
+        Queues a Telegram request for a chat.
+        Args:
+            chat_id (str | int): Chat the request sends to; requests of a chat are paced together.
+            call (callable): Coroutine function making the request, e.g. bot.send_message or message.reply_text.
+            priority (int): PRIORITY_TRANSLATION, PRIORITY_REPLY or PRIORITY_BACKGROUND.
+            coalesce_key (hashable): Requests with the same key replace a queued one of the chat,
+                e.g. successive edits of one message.
+            merge (bool): The `text` may be appended to a queued mergeable text for the same chat, call and topic.
+            kind (str | None): Message kind the call's latency is recorded under; defaults to the priority's name.
+            **kwargs: Arguments of the call, which may include its own chat_id.
+        Returns:
+            asyncio.Future: Resolves to the call's result, or its exception.
+        """
+        chat_id = str(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, [])
+        if self._coalesce(queue, call, priority, coalesce_key, merge, kwargs, future):
+            metrics.increment("send_coalesced_total", priority=PRIORITY_NAMES.get(priority, priority))
+        else:
+            item = {
+                "call": call,
+                "kwargs": kwargs,
+                "coalesce_key": coalesce_key,
+                "merge": merge,
+                "kind": kind or PRIORITY_NAMES.get(priority, priority),
+                "futures": [future],
+                "queued_at": time.perf_counter(),
+                "attempts": 0,
+            }
+            heapq.heappush(queue, (priority, next(self._sequence), item))
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+        return future
+
+    async def send(
+        self, chat_id, call, /, priority: int = PRIORITY_TRANSLATION, coalesce_key=None, merge: bool = False,
+        kind: str | None = None, **kwargs,
+    ):
+        """
+        Queues a Telegram request like submit() and waits for its result.
+        Raises:
+            Exception: The error of the request, after flood-wait retries.
+        """
+        return await self.submit(chat_id, call, priority, coalesce_key, merge, kind, **kwargs)
+
+    def queue_size(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @staticmethod
+    def _coalesce(queue, call, priority, coalesce_key, merge, kwargs, future) -> bool:
+        for queued_priority, _, item in queue:
+            if coalesce_key is not None and item["coalesce_key"] == coalesce_key:
+                item["call"] = call
+                item["kwargs"] = kwargs
+                item["futures"].append(future)
+                return True
+            if (
+                merge and item["merge"] and queued_priority == priority and item["call"] == call
+                and item["kwargs"].get("message_thread_id") == kwargs.get("message_thread_id")
+                and len(item["kwargs"]["text"]) + 2 + len(kwargs["text"]) <= MESSAGE_LIMIT
+            ):
+                item["kwargs"]["text"] += "\n\n" + kwargs["text"]
+                item["futures"].append(future)
+                return True
+        return False
+
+    async def _run_chat(self, chat_id: str):
+        queue = self._queues[chat_id]
+        bucket = self._buckets.setdefault(chat_id, _chat_bucket(chat_id))
+        try:
+            while queue:
+                delay = bucket.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                await self._acquire_global(queue[0][0])
+                priority, _, item = heapq.heappop(queue)
+                bucket.take()
+                await self._perform(chat_id, bucket, queue, priority, item)
+        finally:
+            if self._workers.get(chat_id) is asyncio.current_task():
+                del self._workers[chat_id]
+                if not queue:
+                    self._queues.pop(chat_id, None)
+                    self._forget_bucket(chat_id)
+
+    def _forget_bucket(self, chat_id: str):
+        # An idle chat's bucket is dropped once full again; buckets still refilling (or flood-blocked)
+        # are swept later, when enough have piled up, so _buckets stays bounded by the recently active chats
+        if self._buckets[chat_id].refill_delay() <= 0:
+            del self._buckets[chat_id]
+        if len(self._buckets) >= self._sweep_at:
+            for idle_chat_id in [
+                idle_chat_id for idle_chat_id, bucket in self._buckets.items()
+                if idle_chat_id not in self._workers and bucket.refill_delay() <= 0
+            ]:
+                del self._buckets[idle_chat_id]
+            self._sweep_at = max(IDLE_BUCKETS_SWEEP, 2 * len(self._buckets))
+
+    async def _perform(self, chat_id: str, bucket: TokenBucket, queue: list, priority: int, item: dict):
+        priority_name = PRIORITY_NAMES.get(priority, priority)
+        item["attempts"] += 1
+        try:
+            # Only the request itself: the time spent queued is send_wait_seconds
+            with metrics.timer("telegram_send_seconds", kind=item["kind"]):
+                result = await item["call"](**item["kwargs"])
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            bucket.block(retry_after)
+            metrics.increment("send_flood_waits_total")
+            if item["attempts"] < SEND_MAX_ATTEMPTS:
+                logging.warning(f"Flood control in chat {chat_id}, retrying in {retry_after:g}s")
+                heapq.heappush(queue, (priority, next(self._sequence), item))
+                return
+            metrics.increment("sends_total", priority=priority_name, outcome="error")
+            self._resolve(item, exception=e)
+        except Exception as e:
+            metrics.increment("sends_total", priority=priority_name, outcome="error")
+            self._resolve(item, exception=e)
+        else:
+            metrics.increment("sends_total", priority=priority_name, outcome="ok")
+            metrics.observe("send_wait_seconds", time.perf_counter() - item["queued_at"], priority=priority_name)
+            self._resolve(item, result=result)
+
+    @staticmethod
+    def _resolve(item: dict, result=None, exception: Exception | None = None):
+        for future in item["futures"]:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    async def _acquire_global(self, priority: int):
+        if not self._global_waiters and self.global_bucket.delay() == 0:
+            self.global_bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._global_waiters, (priority, next(self._sequence), future))
+        if self._global_dispatcher is None or self._global_dispatcher.done():
+            self._global_dispatcher = asyncio.create_task(self._dispatch_global())
+        await future
+
+    async def _dispatch_global(self):
+        # Hands out global tokens as they become available, most urgent waiter first
+        while self._global_waiters:
+            delay = self.global_bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._global_waiters)
+            if future.cancelled():
+                continue
+            self.global_bucket.take()
+            future.set_result(None)
+
+send_scheduler = SendScheduler(SEND_GLOBAL_RATE)
+
+metrics.describe("sends_total", "Telegram requests made by the send scheduler, by priority and outcome")
+metrics.describe("telegram_send_seconds", "Latency of Telegram requests by message kind, without time spent queued")
+metrics.describe("send_wait_seconds", "Time sends spent queued in the send scheduler, by priority")
+metrics.describe("send_coalesced_total", "Sends merged into or replacing an already queued send, by priority")
+metrics.describe("send_flood_waits_total", "Flood-wait (RetryAfter) answers from Telegram")
+metrics.register_callback(
+    "send_queue_depth",
+    send_scheduler.queue_size,
+    description="Sends waiting in the send scheduler",
+)
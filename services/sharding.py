@@ -0,0 +1,143 @@
+# services/sharding.py
+"""
+Multi-process deployment: a front process receives updates from Telegram (polling or webhook) and routes
+each one by a hash of its chat id to one of N worker processes. Every group is therefore handled by exactly
+one worker, which keeps its messages in order and keeps the per-process state (language index, queues,
+caches) consistent, while CPU-bound work spreads across cores. Workers share the SQLite database.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import zlib
+
+# Number of worker processes; 1 runs everything in a single process
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Index of this process's shard when running as a worker, None otherwise
+SHARD_INDEX = None
+
+# Spawned rather than forked, so workers do not inherit the front process's threads and connections
+_context = multiprocessing.get_context("spawn")
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """
+    Maps a chat to a worker. Stable across processes and restarts.
+    Args:
+        chat_id (int): Telegram chat identifier.
+        shards (int): Number of workers.
+    Returns:
+        int: The worker index.
+    """
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+def is_router() -> bool:
+    """
+    Tells whether this is the front process of a multi-worker deployment, which only routes updates.
+    """
+    return BOT_WORKERS > 1 and SHARD_INDEX is None
+
+def owns_chat(chat_id) -> bool:
+    """
+    Tells whether this process handles a chat: always in a single process, otherwise only in the chat's
+    worker (never in the front process).
+    """
+    if BOT_WORKERS <= 1:
+        return True
+    return SHARD_INDEX is not None and shard_for(int(chat_id), BOT_WORKERS) == SHARD_INDEX
+
+class ShardRouter:
+    """
+    Owns the worker processes and forwards each update to the worker of its chat.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.queues = [_context.Queue() for _ in range(shards)]
+        self.processes = [None] * shards
+
+    def start(self):
+        for index in range(self.shards):
+            self._start_worker(index)
+
+    def _start_worker(self, index: int):
+        process = _context.Process(
+            target=run_shard_worker,
+            args=(index, self.queues[index]),
+            name=f"bot-shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        logging.info(f"Started shard worker {index} (pid {process.pid})")
+
+    async def route(self, update, context):
+        """
+        Update handler for the front process: forwards the update to its chat's worker
+        and stops local handling of it.
+        """
+        from telegram.ext import ApplicationHandlerStop
+
+        chat = update.effective_chat
+        index = shard_for(chat.id if chat else 0, self.shards)
+        if not self.processes[index].is_alive():
+            logging.warning(f"Shard worker {index} exited with code {self.processes[index].exitcode}, restarting")
+            self._start_worker(index)
+        self.queues[index].put(json.dumps(update.to_dict()))
+        raise ApplicationHandlerStop
+
+    async def stop(self, app=None):
+        """
+        Asks every worker to finish the updates it has, then waits for them to exit.
+        """
+        for queue in self.queues:
+            queue.put(None)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, 30)
+            if process.is_alive():
+                logging.warning(f"Shard worker {index} did not stop in time, terminating")
+                process.terminate()
+
+def run_shard_worker(index: int, queue):
+    """
+    Entry point of a worker process: runs the bot's handlers on the updates routed to this shard.
+    Args:
+        index (int): Worker index.
+        queue (multiprocessing.Queue): Serialized updates from the front process; None stops the worker.
+    """
+    global SHARD_INDEX
+    import bot
+    from services import metrics
+
+    SHARD_INDEX = index
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s shard-{index} %(levelname)s %(message)s")
+    # Each worker exposes its own metrics endpoint next to the front process's one
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += 1 + index
+    bot.init_db()
+    bot.load_language_index()
+    asyncio.run(_serve_shard(index, queue))
+
+async def _serve_shard(index: int, queue):
+    import bot
+    from telegram import Update
+
+    app = bot.build_application(receive_updates=False)
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        await bot.start_background_services(app)
+        logging.info(f"Shard worker {index} is processing updates")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                # Goes through the application's own update queue, so BOT_CONCURRENT_UPDATES applies per worker
+                await app.update_queue.put(Update.de_json(json.loads(data), app.bot))
+        finally:
+            await app.stop()
+            await bot.stop_background_services(app)
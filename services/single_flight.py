@@ -0,0 +1,69 @@
+# services/single_flight.py
+"""
+Coalesces identical concurrent requests: while a call for a key is in flight, later callers with the same key
+wait for its result instead of making their own call.
+The call runs in its own task, so a waiter that is cancelled (e.g. by its timeout) does not cancel it for the
+others; it is cancelled only when every waiter has gone. Errors reach every waiter and are not remembered:
+the next request after a failure makes a new call.
+"""
+
+import asyncio
+
+class Flight:
+    """
+    One in-flight call, its key and the number of callers waiting for it.
+    """
+
+    def __init__(self, key, task: asyncio.Task):
+        self.key = key
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Registry of in-flight calls by key. Used from the event loop only.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def get(self, key) -> Flight | None:
+        """
+        Returns the call in flight for a key, to join with wait(), or None.
+        """
+        return self._flights.get(key)
+
+    def start(self, key, awaitable) -> Flight:
+        """
+        Starts a call for a key; it is forgotten as soon as it finishes.
+        Args:
+            key (hashable): Identifies identical requests.
+            awaitable (Awaitable): The call.
+        Returns:
+            Flight: The call, to pass to wait().
+        """
+        flight = Flight(key, asyncio.ensure_future(awaitable))
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _: self._forget(flight))
+        return flight
+
+    def _forget(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def wait(self, flight: Flight):
+        """
+        Waits for a call's result or exception.
+        """
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Forgotten at once, so a caller arriving before the task has finished cancelling starts a new call
+                self._forget(flight)
+                flight.task.cancel()
+
+    def in_flight(self) -> int:
+        return len(self._flights)
@@ -0,0 +1,227 @@
+# services/system_messages.py
+"""
+The bot's own messages (help, welcome, setup prompt, errors), localized into the languages of the group.
+Every message is translated into every supported language once, stored in the system_messages table,
+and reused from memory afterwards, so localized messages cost no translation calls at runtime.
+The catalog is warmed in the background at startup, one language at a time; a language that is needed
+before its turn is translated right away, and the message goes out in English until it is ready.
+Rendered messages are cached per group language set, since the same groups ask for the same combinations.
+"""
+
+import asyncio
+import logging
+import os
+import string
+import time
+from collections import OrderedDict
+
+from database.models import get_db_connection, run_db
+from services import metrics
+from services.send_scheduler import MESSAGE_LIMIT
+from services.translator import LANGUAGE_CODES, LANGUAGE_NAMES, translate_batch_to_language
+
+# Number of rendered messages kept, one per message and language set
+SYSTEM_MESSAGE_RENDER_CACHE_SIZE = int(os.getenv("SYSTEM_MESSAGE_RENDER_CACHE_SIZE", "2000"))
+# Seconds before a language whose translation failed is tried again
+SYSTEM_MESSAGE_RETRY_SECONDS = float(os.getenv("SYSTEM_MESSAGE_RETRY_SECONDS", "300"))
+
+SOURCE_LANGUAGE = "en"
+
+# English originals; {placeholders} are filled in after translation
+SYSTEM_MESSAGES = {
+    "help": """
+Bot Usage Guide:
+
+- To set your preferred language, simply send the language name (e.g., English, Español, עברית).
+- The bot will translate each message in the group to all preferred languages.
+- You can change your language preference at any time by sending a new language name.
+- Use the command 'bot help' to see this help message again.
+""".strip(),
+    "setup": "Language setup initiated. Each user, please send your preferred language (e.g., English, Español, עברית).\nSend 'bot help' to view instructions.",
+    "welcome": "Welcome {user_name}! Please send me your preferred language (e.g., English, Español, עברית).",
+    "no_languages": "No language preferences found in this group. Please send your preferred language.",
+    "empty_language": "Please provide a valid language name.",
+    "language_set": "Language preference for {user_name} set to '{language}'.\nYou can change it anytime by sending 'change language: <language>'.",
+    "invalid_language": "Invalid language '{language}'. Please send a valid language name.\nIf you need help, type 'bot help'.",
+    "invalid_language_suggestions": "Invalid language '{language}'. Did you mean {suggestions}? Please send a valid language name.\nIf you need help, type 'bot help'.",
+    "queue_full": "Too many messages right now, this one was not translated. Please try again shortly.",
+}
+
+# Telegram user language codes (IETF tags) that differ from the translator's codes
+_TELEGRAM_LANGUAGE_CODES = {"he": "iw", "zh-hans": "zh-CN", "zh-hant": "zh-TW", "zh": "zh-CN", "jv": "jw"}
+
+def telegram_language(language_code: str | None) -> str | None:
+    """
+    Maps a Telegram user's language_code (e.g. "pt-br", "he") to a supported language code.
+    Returns:
+        str | None: The language code, or None if the language is not supported.
+    """
+    if not language_code:
+        return None
+    language_code = language_code.lower()
+    for candidate in (language_code, language_code.split("-")[0]):
+        candidate = _TELEGRAM_LANGUAGE_CODES.get(candidate, candidate)
+        if candidate in LANGUAGE_NAMES:
+            return candidate
+    return None
+
+def _fields(template: str) -> set | None:
+    # Placeholder names of a template, or None if it is not a valid format string
+    try:
+        return {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError:
+        return None
+
+def _load_catalog() -> list:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, language, source, text FROM system_messages")
+    return cursor.fetchall()
+
+def _save_translations(rows: list):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO system_messages (name, language, source, text)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(name, language) DO UPDATE SET source=excluded.source, text=excluded.text
+    """, rows)
+    conn.commit()
+
+class SystemMessageCatalog:
+    """
+    Translations of the system messages into every language, filled lazily and persisted.
+    """
+
+    def __init__(self, templates: dict):
+        self.templates = templates
+        # {(name, language): translated template}
+        self._texts = {}
+        # {(name, languages): rendered template}, least recently used first
+        self._rendered = OrderedDict()
+        # Languages being translated: {language: Task}, and when a language last failed: {language: monotonic time}
+        self._filling = {}
+        self._failed_at = {}
+        self._loaded = False
+
+    def render(self, name: str, languages: list, **values) -> str:
+        """
+        Returns a system message in English followed by each of the given languages that is ready.
+        Languages not translated yet are queued for translation and left out this time.
+        Args:
+            name (str): Message name, a key of SYSTEM_MESSAGES.
+            languages (list): Language codes to include, in order.
+            **values: Values of the message's placeholders.
+        Returns:
+            str: The message text.
+        """
+        key = (name, tuple(languages))
+        template = self._rendered.get(key)
+        if template is None:
+            template = self._join(name, languages)
+        else:
+            self._rendered.move_to_end(key)
+        return template.format(**values)
+
+    def _join(self, name: str, languages: list) -> str:
+        parts = [self.templates[name]]
+        length = len(parts[0])
+        complete = True
+        for language in dict.fromkeys(languages):
+            if language == SOURCE_LANGUAGE:
+                continue
+            text = self._texts.get((name, language))
+            if text is None:
+                complete = False
+                # Until the stored translations are loaded, missing ones may just not be read yet
+                if self._loaded:
+                    self._fill(language)
+                continue
+            # Translations identical to the original (or to another language) add nothing, and those
+            # that would make the message too long for Telegram are left out
+            if text in parts or length + 2 + len(text) > MESSAGE_LIMIT:
+                continue
+            parts.append(text)
+            length += 2 + len(text)
+        template = "\n\n".join(parts)
+        # Only final renderings are cached; the others change as translations arrive
+        if complete:
+            self._rendered[(name, tuple(languages))] = template
+            while len(self._rendered) > SYSTEM_MESSAGE_RENDER_CACHE_SIZE:
+                self._rendered.popitem(last=False)
+        return template
+
+    def _fill(self, language: str) -> asyncio.Task | None:
+        if language not in LANGUAGE_NAMES:
+            return None
+        if time.monotonic() - self._failed_at.get(language, float("-inf")) < SYSTEM_MESSAGE_RETRY_SECONDS:
+            return None
+        task = self._filling.get(language)
+        if task is None or task.done():
+            task = self._filling[language] = asyncio.get_running_loop().create_task(self._translate_language(language))
+        return task
+
+    async def _translate_language(self, language: str):
+        names = [name for name in self.templates if (name, language) not in self._texts]
+        if not names:
+            return
+        sources = [self.templates[name] for name in names]
+        translated = await translate_batch_to_language(sources, language, source=SOURCE_LANGUAGE)
+        rows = []
+        for name, source, text in zip(names, sources, translated):
+            if isinstance(text, Exception):
+                self._failed_at[language] = time.monotonic()
+                metrics.increment("system_message_translations_total", outcome="error")
+                continue
+            # A translation that lost or broke a placeholder would fail to format; the English original
+            # is stored in its place, so the language shows English and is not translated again
+            if _fields(text) != _fields(source):
+                text = source
+                metrics.increment("system_message_translations_total", outcome="rejected")
+            else:
+                metrics.increment("system_message_translations_total", outcome="ok")
+            self._texts[(name, language)] = text
+            rows.append((name, language, source, text))
+        if rows:
+            await run_db(_save_translations, rows)
+
+    async def load(self):
+        """
+        Loads the stored translations. Rows translated from an older version of a message are ignored.
+        """
+        for row in await run_db(_load_catalog):
+            if self.templates.get(row["name"]) == row["source"]:
+                self._texts[(row["name"], row["language"])] = row["text"]
+        self._loaded = True
+
+    async def warm(self, languages: list | None = None):
+        """
+        Loads the stored translations, then translates whatever is missing, one language at a time
+        so live translations keep most of the backend's capacity.
+        Args:
+            languages (list | None): Languages to prepare. Defaults to every supported language.
+        """
+        if not self._loaded:
+            await self.load()
+        for language in languages or sorted(set(LANGUAGE_CODES.values())):
+            if language == SOURCE_LANGUAGE:
+                continue
+            task = self._fill(language)
+            if task is None:
+                continue
+            try:
+                await task
+            except Exception as e:
+                logging.warning(f"Translating system messages into {language} failed: {e}")
+
+    def size(self) -> int:
+        return len(self._texts)
+
+system_messages = SystemMessageCatalog(SYSTEM_MESSAGES)
+
+metrics.describe("system_message_translations_total", "System message translations added to the catalog, by outcome")
+metrics.register_callback(
+    "system_message_catalog_entries",
+    system_messages.size,
+    description="Translated system messages in the catalog",
+)
@@ -0,0 +1,244 @@
+# services/translation_cache.py
+"""
+This service module caches translation results so repeated messages ("ok", "thanks", emoji-only lines)
+do not cost a translator request each time.
+Entries are keyed by normalized source text, source language (as given to the backend, 'auto' included) and
+target language code, so a translation made with a wrong explicit source is never served to other requests.
+They are evicted by size (LRU) and age (TTL).
+An optional SQLite-backed second tier keeps warm entries across restarts; its expired rows are deleted
+while writing, at most once per TRANSLATION_CACHE_PRUNE_INTERVAL.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from database.models import get_db_connection
+from services import metrics
+
+# Maximum number of entries kept in memory
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "10000"))
+# Seconds an entry stays valid, in memory and on disk
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
+# Longer messages are rarely repeated verbatim and are not cached
+TRANSLATION_CACHE_MAX_TEXT_LENGTH = int(os.getenv("TRANSLATION_CACHE_MAX_TEXT_LENGTH", "500"))
+# Set to "1" to keep entries in the translation_cache table across restarts
+TRANSLATION_CACHE_PERSIST = os.getenv("TRANSLATION_CACHE_PERSIST", "0") == "1"
+# Minimum seconds between two deletions of expired rows from the translation_cache table
+TRANSLATION_CACHE_PRUNE_INTERVAL = float(os.getenv("TRANSLATION_CACHE_PRUNE_INTERVAL", "3600"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes source text for use as a cache key.
+    Whitespace is collapsed, but case is kept because it can change the translation.
+    Args:
+        text (str): Source text.
+    Returns:
+        str: The normalized text.
+    """
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+class TranslationCache:
+    """
+    Bounded LRU cache of translations with TTL expiry and an optional persistent tier.
+    Safe to use from the event loop and from translation worker threads.
+    """
+
+    def __init__(self, max_size: int, ttl: float, persistent: bool = False, max_text_length: int = 500):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self.max_text_length = max_text_length
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # When expired rows were last deleted from the persistent tier (monotonic); the first write prunes
+        self._pruned_at = float("-inf")
+
+    def cacheable(self, text: str) -> bool:
+        return self.max_size > 0 and len(text) <= self.max_text_length
+
+    def get(self, text: str, target: str, source: str = "auto") -> str | None:
+        """
+        Looks up a translation in memory only. Never blocks on I/O.
+        A miss is not counted here, because the caller is expected to follow up with load().
+        Args:
+            text (str): Source text.
+            target (str): Target language code.
+            source (str): Source language code the translation was requested with, or 'auto'.
+        Returns:
+            str | None: The cached translation, or None.
+        """
+        if not self.cacheable(text):
+            return None
+        key = (normalize_text(text), source, target)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            translation, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return translation
+
+    def load(self, text: str, target: str, source: str = "auto") -> str | None:
+        """
+        Looks up a translation in the persistent tier, promoting it to memory on a hit.
+        Counts a miss when the translation has to come from the backend.
+        Args:
+            text (str): Source text.
+            target (str): Target language code.
+            source (str): Source language code, or 'auto'.
+        Returns:
+            str | None: The stored translation, or None.
+        """
+        if not self.cacheable(text):
+            return None
+        translation = None
+        if self.persistent:
+            translation = self._load_persistent(normalize_text(text), source, target)
+        with self._lock:
+            if translation is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.persistent_hits += 1
+        self._store(normalize_text(text), source, target, translation)
+        return translation
+
+    def put(self, text: str, target: str, translation: str, source: str = "auto"):
+        """
+        Stores a translation in memory and, if enabled, in the persistent tier.
+        Args:
+            text (str): Source text.
+            target (str): Target language code.
+            translation (str): Translated text.
+            source (str): Source language code the translation was requested with, or 'auto'.
+        """
+        if not self.cacheable(text):
+            return
+        key_text = normalize_text(text)
+        self._store(key_text, source, target, translation)
+        if self.persistent:
+            self._save_persistent(key_text, source, target, translation)
+
+    async def load_async(self, text: str, target: str, source: str = "auto") -> str | None:
+        """
+        Like load(), but reads the persistent tier in a worker thread so the event loop is not blocked.
+        """
+        if self.persistent and self.cacheable(text):
+            return await asyncio.to_thread(self.load, text, target, source)
+        return self.load(text, target, source)
+
+    async def put_async(self, text: str, target: str, translation: str, source: str = "auto"):
+        """
+        Like put(), but writes the persistent tier in a worker thread so the event loop is not blocked.
+        """
+        if self.persistent and self.cacheable(text):
+            await asyncio.to_thread(self.put, text, target, translation, source)
+        else:
+            self.put(text, target, translation, source)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and the current size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def _store(self, key_text: str, source: str, target: str, translation: str):
+        key = (key_text, source, target)
+        with self._lock:
+            self._entries[key] = (translation, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _load_persistent(self, key_text: str, source: str, target: str) -> str | None:
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT translation FROM translation_cache
+                WHERE source_text = ? AND source = ? AND target = ? AND created_at >= ?
+            """, (key_text, source, target, time.time() - self.ttl))
+            row = cursor.fetchone()
+        except Exception as e:
+            logging.warning(f"Translation cache lookup failed: {e}")
+            return None
+        return row["translation"] if row else None
+
+    def _save_persistent(self, key_text: str, source: str, target: str, translation: str):
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO translation_cache (source_text, source, target, translation, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key_text, source, target, translation, time.time()))
+            conn.commit()
+        except Exception as e:
+            logging.warning(f"Translation cache write failed: {e}")
+            return
+        self._prune_persistent()
+
+    def _prune_persistent(self):
+        # Expired rows are never read again, but would otherwise stay in the table forever
+        with self._lock:
+            now = time.monotonic()
+            if now - self._pruned_at < TRANSLATION_CACHE_PRUNE_INTERVAL:
+                return
+            self._pruned_at = now
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM translation_cache WHERE created_at < ?
+            """, (time.time() - self.ttl,))
+            conn.commit()
+        except Exception as e:
+            logging.warning(f"Translation cache pruning failed: {e}")
+            return
+        if cursor.rowcount:
+            metrics.increment("translation_cache_pruned_total", cursor.rowcount)
+
+# Shared cache used by the translator service
+translation_cache = TranslationCache(
+    TRANSLATION_CACHE_SIZE,
+    TRANSLATION_CACHE_TTL,
+    persistent=TRANSLATION_CACHE_PERSIST,
+    max_text_length=TRANSLATION_CACHE_MAX_TEXT_LENGTH,
+)
+
+metrics.describe("translation_cache_pruned_total", "Expired rows deleted from the persistent translation cache")
+metrics.register_callback(
+    "translation_cache_lookups_total",
+    lambda: {(("result", result),): translation_cache.stats()[result] for result in ("hits", "persistent_hits", "misses")},
+    kind="counter",
+    description="Translation cache lookups by result",
+)
+metrics.register_callback(
+    "translation_cache_entries",
+    lambda: translation_cache.stats()["size"],
+    description="Entries in the in-memory translation cache",
+)
@@ -4,14 +4,38 @@ Handles language mapping and translation utilities for the Telegram translation
 Enable users to select languages by name and display translations in a clear, readable format.
 
 Functions:
-- validate_language(): Validates user input and returns language code.
-- translate_to_multiple_languages(): Translates a message to multiple languages using Google Translator.
+- validate_language(): Resolves a language name (English or native, code, alias, prefix or typo) to its code.
+- format_translations(): Renders per-language results as the reply text.
+- translate_batch_to_language(): Translates several messages into one language with as few backend calls as possible.
+- translate_long_message(): Translates a long message sentence by sentence, in parallel chunks.
+- set_backend(): Replaces the translation backend (see services/backends.py).
+
+Backend calls go through services/resilience.py, which retries, hedges and fails over between backends.
+Concurrent identical requests (same text, source and target) share one backend call (services/single_flight.py).
 """
 
-from deep_translator import GoogleTranslator
+import asyncio
+import os
+import re
+import time
 
-# Language code to language name mapping
-LANGUAGE_NAMES = {
+from services import metrics
+from services.backends import TRANSLATION_BACKEND, TranslationBackend
+from services.language_index import LanguageIndex
+from services.resilience import create_resilient_backend
+from services.segmentation import split_segments, pack_segments, join_translated
+from services.single_flight import SingleFlight
+from services.translation_cache import normalize_text, translation_cache
+
+# Upper bound on translation requests in flight at once, across all groups
+TRANSLATION_MAX_CONCURRENCY = int(os.getenv("TRANSLATION_MAX_CONCURRENCY", "8"))
+# Seconds to wait for a single language before giving up on it
+TRANSLATION_TIMEOUT = float(os.getenv("TRANSLATION_TIMEOUT", "10"))
+# Size of the chunks long messages are split into; each chunk is one request, sent in parallel
+TRANSLATION_CHUNK_CHARS = int(os.getenv("TRANSLATION_CHUNK_CHARS", "1500"))
+
+# Language code to English name with the native name in parentheses
+NATIVE_LANGUAGE_NAMES = {
     "af": "Afrikaans",
     "sq": "Albanian (Shqip)",
     "am": "Amharic (አማርኛ)",
@@ -286,27 +310,227 @@ LANGUAGE_CODES = {
 # Language code to language name mapping
 LANGUAGE_NAMES = {v: k.capitalize() for k, v in LANGUAGE_CODES.items()}
 
+# Other common names and codes users type for a language
+LANGUAGE_ALIASES = {
+    "he": "iw",
+    "ivrit": "iw",
+    "jv": "jw",
+    "zh": "zh-CN",
+    "chinese": "zh-CN",
+    "mandarin": "zh-CN",
+    "farsi": "fa",
+    "tagalog": "tl",
+    "burmese": "my",
+    "kurdish": "ku",
+    "manipuri": "mni-Mtei",
+    "odia": "or",
+    "oriya": "or",
+    "castellano": "es",
+    "brazilian": "pt",
+    "moldovan": "ro",
+    "flemish": "nl",
+    "nyanja": "ny",
+    "kiswahili": "sw",
+}
+
+def _index_names() -> dict:
+    # English names, codes, every part of the native display names ("Myanmar (Burmese) (မြန်မာစာ)"), then aliases
+    names = dict(LANGUAGE_CODES)
+    for code, display_name in NATIVE_LANGUAGE_NAMES.items():
+        names.setdefault(code, code)
+        names.setdefault(display_name, code)
+        for part in re.findall(r"[^()]+", display_name):
+            names.setdefault(part.strip(), code)
+    for alias, code in LANGUAGE_ALIASES.items():
+        names.setdefault(alias, code)
+    return names
+
+_language_index = LanguageIndex(_index_names())
+
 class InvalidLanguageException(Exception):
-    pass
+    def __init__(self, message: str, suggestions: list | None = None):
+        super().__init__(message)
+        # Names of the closest supported languages, best first
+        self.suggestions = suggestions or []
 
 def validate_language(language_name: str) -> str:
-    normalized = language_name.strip().lower()
-    if normalized not in LANGUAGE_CODES:
-        raise InvalidLanguageException(
-            f"Language '{language_name}' is not supported.\n"
-            f"Supported languages:\n{', '.join(sorted(LANGUAGE_CODES.keys()))}"
-        )
-    return LANGUAGE_CODES[normalized]
+    """
+    Resolves a language name typed by a user - English or native name, code or alias,
+    an unambiguous prefix, or with a small typo - to its language code.
+    Args:
+        language_name (str): The name as typed.
+    Returns:
+        str: The language code.
+    Raises:
+        InvalidLanguageException: The name matches no language, or several; carries suggestions.
+    """
+    lang_code = _language_index.resolve(language_name)
+    if lang_code is None:
+        suggestions = [LANGUAGE_NAMES.get(code, code) for code in _language_index.suggest(language_name)]
+        raise InvalidLanguageException(f"Language '{language_name}' is not supported.", suggestions)
+    return lang_code
+
+# Backend used for all translations, chosen by TRANSLATION_BACKEND, with TRANSLATION_FALLBACK_BACKENDS behind it
+_backend = create_resilient_backend(TRANSLATION_BACKEND)
+
+def get_backend() -> TranslationBackend:
+    return _backend
+
+def set_backend(backend: TranslationBackend):
+    """
+    Replaces the translation backend, e.g. with a FakeBackend for load tests.
+    Args:
+        backend (TranslationBackend): The backend to use from now on.
+    """
+    global _backend
+    _backend = backend
+
+metrics.describe("translator_request_seconds", "Latency of translation backend requests by target language and outcome")
+metrics.describe("translator_requests_total", "Translation backend requests by target language and outcome")
+metrics.describe("translator_texts_total", "Texts sent to the translation backend by target language")
+
+def _record_backend_call(lang_code: str, outcome: str, start: float, texts: int = 1):
+    metrics.observe("translator_request_seconds", time.perf_counter() - start, language=lang_code, outcome=outcome)
+    metrics.increment("translator_requests_total", language=lang_code, outcome=outcome)
+    metrics.increment("translator_texts_total", texts, language=lang_code)
 
-def translate_to_multiple_languages(message: str, languages: list) -> str:
+def format_translations(results: dict) -> str:
+    """
+    Renders translation results as one line per language, in the order given.
+    Args:
+        results (dict): Language code -> translated text, or the exception raised for that language.
+    Returns:
+        str: The formatted reply body.
+    """
     result_lines = []
-    for lang_code in languages:
-        try:
-            translated_text = GoogleTranslator(source='auto', target=lang_code).translate(text=message)
+    for lang_code, translated_text in results.items():
+        if isinstance(translated_text, Exception):
+            result_lines.append(f"{lang_code}: Translation failed ({str(translated_text) or type(translated_text).__name__})")
+        else:
             language_name = LANGUAGE_NAMES.get(lang_code, lang_code)
             result_lines.append(f"{language_name}: {translated_text}")
-        except Exception as e:
-            result_lines.append(f"{lang_code}: Translation failed ({str(e)})")
     return "\n".join(result_lines)
 
+# Shared by all concurrent callers so a busy group cannot flood the backend
+_translation_semaphore = asyncio.Semaphore(TRANSLATION_MAX_CONCURRENCY)
+
+# Backend calls in flight by (text, source, target): identical requests from different groups
+# (e.g. one announcement forwarded into many of them) wait for the same call instead of making their own
+_in_flight = SingleFlight()
+
+metrics.describe("translator_coalesced_total", "Translation requests answered by joining an identical call in flight, by target language")
+metrics.register_callback(
+    "translator_calls_in_flight",
+    _in_flight.in_flight,
+    description="Distinct translation requests in flight",
+)
+
+def _flight_key(message: str, lang_code: str, source: str) -> tuple:
+    # Texts the cache treats as equal share a call too
+    return (normalize_text(message), source, lang_code)
+
+async def _translate_batch_cached_async(messages: list, lang_code: str, source: str = "auto") -> list:
+    results = [await translation_cache.load_async(message, lang_code, source) for message in messages]
+    missing = [index for index, cached in enumerate(results) if cached is None]
+    if missing:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            translated = await _backend.translate_batch_async([messages[index] for index in missing], lang_code, source)
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "timeout"
+            raise
+        except Exception as e:
+            translated = [e] * len(missing)
+        finally:
+            _record_backend_call(lang_code, outcome, start, texts=len(missing))
+        for index, translated_text in zip(missing, translated):
+            results[index] = translated_text
+            if not isinstance(translated_text, Exception):
+                await translation_cache.put_async(messages[index], lang_code, translated_text, source)
+    return results
+
+async def _translate_batch_limited(messages: list, lang_code: str, timeout: float, source: str) -> list:
+    async with _translation_semaphore:
+        try:
+            return await asyncio.wait_for(_translate_batch_cached_async(messages, lang_code, source), timeout)
+        except asyncio.TimeoutError:
+            return [TimeoutError(f"timed out after {timeout:g}s")] * len(messages)
+
+async def _batch_item(batch: asyncio.Future, position: int) -> str:
+    # Shielded: when one text's waiters all leave, the call the batch's other texts share keeps going
+    translated_text = (await asyncio.shield(batch))[position]
+    if isinstance(translated_text, Exception):
+        raise translated_text
+    return translated_text
+
+async def translate_batch_to_language(messages: list, lang_code: str, timeout: float | None = None, source: str = "auto") -> list:
+    """
+    Translates several messages into one language with as few backend calls as possible,
+    bounded by TRANSLATION_MAX_CONCURRENCY across all callers.
+    Args:
+        messages (list): Texts to translate.
+        lang_code (str): Target language code.
+        timeout (float | None): Timeout in seconds for the whole batch. Defaults to TRANSLATION_TIMEOUT.
+        source (str): Source language code shared by all messages, or 'auto'.
+    Returns:
+        list: Translated text, or the exception raised, for each message in order.
+    """
+    timeout = TRANSLATION_TIMEOUT if timeout is None else timeout
+    results = [translation_cache.get(message, lang_code, source) for message in messages]
+    missing = [index for index, cached in enumerate(results) if cached is None]
+    if not missing:
+        return results
+    # Texts already in flight (for this batch's group or another) are waited for; the rest go in one call
+    flights = {}
+    new = {}
+    keys = [_flight_key(messages[index], lang_code, source) for index in missing]
+    for index, key in zip(missing, keys):
+        if key in flights or key in new:
+            continue
+        flight = _in_flight.get(key)
+        if flight is None:
+            new[key] = messages[index]
+        else:
+            flights[key] = flight
+            metrics.increment("translator_coalesced_total", language=lang_code)
+    if new:
+        batch = asyncio.ensure_future(_translate_batch_limited(list(new.values()), lang_code, timeout, source))
+        for position, key in enumerate(new):
+            flights[key] = _in_flight.start(key, _batch_item(batch, position))
+    translated = await asyncio.gather(*(_in_flight.wait(flights[key]) for key in keys), return_exceptions=True)
+    for index, translated_text in zip(missing, translated):
+        results[index] = translated_text
+    return results
+
+metrics.describe("translator_chunks_total", "Chunks long messages were split into, by target language")
 
+async def translate_long_message(message: str, lang_code: str, timeout: float | None = None, source: str = "auto") -> str:
+    """
+    Translates a long message into one language.
+    The message is split into sentences, and the sentences are packed into chunks of up to
+    TRANSLATION_CHUNK_CHARS that are translated in parallel. Sentences are cached individually,
+    so repeated sentences (quotes, signatures, re-pasted text) are not translated again.
+    Args:
+        message (str): Text to translate.
+        lang_code (str): Target language code.
+        timeout (float | None): Timeout in seconds for each chunk. Defaults to TRANSLATION_TIMEOUT.
+        source (str): Source language code, or 'auto'.
+    Returns:
+        str: The translated text.
+    Raises:
+        Exception: The error of the first sentence that could not be translated.
+    """
+    segments = split_segments(message, TRANSLATION_CHUNK_CHARS)
+    chunks = pack_segments(segments, TRANSLATION_CHUNK_CHARS)
+    metrics.increment("translator_chunks_total", len(chunks), language=lang_code)
+    outcomes = await asyncio.gather(*(
+        translate_batch_to_language([segments[index] for index in chunk], lang_code, timeout, source)
+        for chunk in chunks
+    ))
+    translated = [translated_text for outcome in outcomes for translated_text in outcome]
+    for translated_text in translated:
+        if isinstance(translated_text, Exception):
+            raise translated_text
+    return join_translated(segments, translated)
@@ -2,10 +2,144 @@
 """
 This service module manages user language preferences within Telegram groups.
 It provides functions to set, retrieve, and reset language preferences.
+
+Group languages are served from an in-memory index that is kept up to date by every write, so routing
+a message needs no database I/O. The index has two levels, loaded lazily per group:
+- per-language member counts, read from the small group_languages summary table, which is all
+  that routing a message needs;
+- the members themselves (group_id -> user_id -> language), read from group_users only when a group's
+  members are needed (setting a language, recording activity, per-recipient delivery).
+Ids are strings here, as the handlers use them, and integers in the database.
+
+Target languages only include languages with a member seen (message or join) within MEMBER_ACTIVE_DAYS.
+Activity is recorded in memory and written in batches by maintain_members(), which also removes members
+not seen for MEMBER_RETENTION_DAYS.
 """
 
+import asyncio
 import logging
-from database.models import get_db_connection
+import os
+import threading
+import time
+from collections import Counter
+from database.models import get_db_connection, run_db
+from services import metrics
+
+# Only languages with a member seen within this many days are translated; 0 translates every language
+MEMBER_ACTIVE_DAYS = float(os.getenv("MEMBER_ACTIVE_DAYS", "30"))
+# Members not seen for this many days are removed; 0 keeps them
+MEMBER_RETENTION_DAYS = float(os.getenv("MEMBER_RETENTION_DAYS", "180"))
+# Seconds between writes of recorded member activity
+MEMBER_ACTIVITY_FLUSH_SECONDS = float(os.getenv("MEMBER_ACTIVITY_FLUSH_SECONDS", "60"))
+# Seconds between removals of stale members
+MEMBER_COMPACTION_INTERVAL = float(os.getenv("MEMBER_COMPACTION_INTERVAL", "21600"))
+
+# Members per group: {group_id: {user_id: language}}, filled lazily per group
+_group_members = {}
+# Per-language member counts: {group_id: Counter({language: members})}, filled lazily per group
+_group_language_counts = {}
+# Latest activity of each group language: {group_id: {language: unix time}}, loaded with the counts
+_group_language_seen = {}
+# Activity recorded since the last flush: {(group_id, user_id): unix time}
+_pending_activity = {}
+_index_lock = threading.Lock()
+# Set once load_language_index() has loaded every group's counts; unknown groups are then known to be empty
+_index_complete = False
+
+metrics.describe("language_lookup_seconds", "Time to resolve the target languages of a group")
+metrics.describe("member_activity_writes_total", "Member activity updates written to the database")
+metrics.describe("members_removed_total", "Members removed from group_users, by reason (left, stale)")
+
+def _index_user_language(group_id: str, user_id: str, language: str, seen: float = 0.0):
+    members = _group_members[group_id]
+    counts = _group_language_counts[group_id]
+    previous = members.get(user_id)
+    if previous is not None:
+        counts[previous] -= 1
+        if counts[previous] <= 0:
+            del counts[previous]
+    members[user_id] = language
+    counts[language] += 1
+    _mark_seen(group_id, language, seen)
+
+def _mark_seen(group_id: str, language: str, seen: float):
+    language_seen = _group_language_seen.setdefault(group_id, {})
+    language_seen[language] = max(language_seen.get(language, 0.0), seen)
+
+def _load_counts(group_id: str, replace: bool = False):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT languages.code, group_languages.members, group_languages.last_seen
+        FROM group_languages JOIN languages USING (language_id)
+        WHERE group_languages.group_id = ?
+    """, (int(group_id),))
+    rows = cursor.fetchall()
+    with _index_lock:
+        if not replace and group_id in _group_language_counts:
+            return
+        _group_language_counts[group_id] = Counter({row["code"]: row["members"] for row in rows})
+        _group_language_seen[group_id] = {row["code"]: row["last_seen"] for row in rows}
+
+def _ensure_counts_loaded(group_id: str):
+    with _index_lock:
+        if group_id in _group_language_counts:
+            return
+        if _index_complete:
+            _group_language_counts[group_id] = Counter()
+            return
+    _load_counts(group_id)
+
+def _ensure_members_loaded(group_id: str):
+    with _index_lock:
+        if group_id in _group_members:
+            return
+        if _index_complete and group_id not in _group_language_counts:
+            _group_members[group_id] = {}
+            _group_language_counts[group_id] = Counter()
+            return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT group_users.user_id, languages.code, group_users.last_seen
+        FROM group_users JOIN languages USING (language_id)
+        WHERE group_users.group_id = ?
+    """, (int(group_id),))
+    rows = cursor.fetchall()
+    with _index_lock:
+        if group_id in _group_members:
+            return
+        # Counts are rebuilt from the members so both levels agree
+        _group_members[group_id] = {}
+        _group_language_counts[group_id] = Counter()
+        for row in rows:
+            _index_user_language(group_id, str(row["user_id"]), row["code"], row["last_seen"])
+
+def load_language_index():
+    """
+    Loads the per-language member counts of every group into the in-memory index.
+    Called once at startup so the first message of each group is also served from memory.
+    Members are still loaded per group on demand, so startup cost follows the number of groups,
+    not the number of memberships.
+    """
+    global _index_complete
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT group_languages.group_id, languages.code, group_languages.members, group_languages.last_seen
+        FROM group_languages JOIN languages USING (language_id)
+    """)
+    rows = cursor.fetchall()
+    with _index_lock:
+        _group_members.clear()
+        _group_language_counts.clear()
+        _group_language_seen.clear()
+        for row in rows:
+            group_id = str(row["group_id"])
+            _group_language_counts.setdefault(group_id, Counter())[row["code"]] = row["members"]
+            _group_language_seen.setdefault(group_id, {})[row["code"]] = row["last_seen"]
+        _index_complete = True
+    logging.info(f"Loaded language index for {len(_group_language_counts)} groups")
 
 def set_user_language(group_id: str, user_id: str, user_name: str, language: str):
     """
@@ -16,15 +150,21 @@ def set_user_language(group_id: str, user_id: str, user_name: str, language: str
         user_name (str): User's display name.
         language (str): Language code (e.g., 'en', 'he').
     """
+    now = time.time()
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO group_users (group_id, user_id, user_name, language)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(group_id, user_id) DO UPDATE SET language=excluded.language
-    """, (group_id, user_id, user_name, language))
+        INSERT OR IGNORE INTO languages (code) VALUES (?)
+    """, (language,))
+    cursor.execute("""
+        INSERT INTO group_users (group_id, user_id, user_name, language_id, last_seen)
+        VALUES (?, ?, ?, (SELECT language_id FROM languages WHERE code = ?), ?)
+        ON CONFLICT(group_id, user_id) DO UPDATE SET language_id=excluded.language_id, last_seen=excluded.last_seen
+    """, (int(group_id), int(user_id), user_name, language, now))
     conn.commit()
-    conn.close()
+    _ensure_members_loaded(group_id)
+    with _index_lock:
+        _index_user_language(group_id, user_id, language, now)
     logging.info(f"Updated language for {user_name} in group {group_id}: {language}")
 
 def get_user_language(group_id: str, user_id: str) -> str | None:
@@ -36,31 +176,54 @@ def get_user_language(group_id: str, user_id: str) -> str | None:
     Returns:
         str | None: The language code if found, otherwise None.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT language FROM group_users WHERE group_id = ? AND user_id = ?
-    """, (group_id, user_id))
-    row = cursor.fetchone()
-    conn.close()
-    return row["language"] if row else None
+    _ensure_members_loaded(group_id)
+    with _index_lock:
+        return _group_members[group_id].get(user_id)
 
 def get_all_languages(group_id: str) -> list[str]:
     """
-    Retrieves a list of unique languages preferred by users in a group.
+    Retrieves a list of unique languages preferred by active users in a group:
+    languages with at least one member seen within MEMBER_ACTIVE_DAYS.
     Args:
         group_id (str): Telegram group identifier.
     Returns:
         list[str]: List of unique language codes.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT DISTINCT language FROM group_users WHERE group_id = ?
-    """, (group_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [row["language"] for row in rows]
+    with metrics.timer("language_lookup_seconds"):
+        _ensure_counts_loaded(group_id)
+        with _index_lock:
+            if MEMBER_ACTIVE_DAYS <= 0:
+                return list(_group_language_counts[group_id])
+            cutoff = time.time() - MEMBER_ACTIVE_DAYS * 86400
+            language_seen = _group_language_seen.get(group_id, {})
+            return [language for language in _group_language_counts[group_id] if language_seen.get(language, 0.0) >= cutoff]
+
+def get_language_counts(group_id: str) -> dict[str, int]:
+    """
+    Retrieves the number of members preferring each language in a group.
+    Args:
+        group_id (str): Telegram group identifier.
+    Returns:
+        dict[str, int]: Language code -> number of members.
+    """
+    _ensure_counts_loaded(group_id)
+    with _index_lock:
+        return dict(_group_language_counts[group_id])
+
+def get_members_by_language(group_id: str) -> dict[str, list[str]]:
+    """
+    Groups the members of a group by their preferred language.
+    Args:
+        group_id (str): Telegram group identifier.
+    Returns:
+        dict[str, list[str]]: Language code -> user ids of the members preferring it.
+    """
+    _ensure_members_loaded(group_id)
+    members_by_language = {}
+    with _index_lock:
+        for user_id, language in _group_members[group_id].items():
+            members_by_language.setdefault(language, []).append(user_id)
+    return members_by_language
 
 def reset_group_languages(group_id: str):
     """
@@ -72,7 +235,128 @@ def reset_group_languages(group_id: str):
     cursor = conn.cursor()
     cursor.execute("""
         DELETE FROM group_users WHERE group_id = ?
-    """, (group_id,))
+    """, (int(group_id),))
     conn.commit()
-    conn.close()
+    with _index_lock:
+        _group_members[group_id] = {}
+        _group_language_counts[group_id] = Counter()
+        _group_language_seen[group_id] = {}
     logging.info(f"Reset languages for group {group_id}")
+
+def record_activity(group_id: str, user_id: str):
+    """
+    Records that a member was seen (sent a message or joined). The time is kept in memory and written
+    by flush_activity(), and the member's language counts as active right away.
+    Loads the group's members from the database on first use; see record_activity_async().
+    Args:
+        group_id (str): Telegram group identifier.
+        user_id (str): Telegram user identifier.
+    """
+    now = time.time()
+    _ensure_members_loaded(group_id)
+    with _index_lock:
+        _pending_activity[(group_id, user_id)] = now
+        language = _group_members.get(group_id, {}).get(user_id)
+        if language is not None:
+            _mark_seen(group_id, language, now)
+
+async def record_activity_async(group_id: str, user_id: str):
+    """
+    Like record_activity(), but loads the group's members in the database thread when they are not loaded yet,
+    so the event loop is not blocked.
+    """
+    with _index_lock:
+        loaded = group_id in _group_members
+    if loaded:
+        record_activity(group_id, user_id)
+    else:
+        await run_db(record_activity, group_id, user_id)
+
+def flush_activity() -> int:
+    """
+    Writes the member activity recorded since the last flush in one transaction, and refreshes
+    the activity of the languages of the groups involved.
+    Returns:
+        int: Number of activity updates written.
+    """
+    global _pending_activity
+    with _index_lock:
+        pending, _pending_activity = _pending_activity, {}
+    if not pending:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        UPDATE group_users SET last_seen = MAX(last_seen, ?) WHERE group_id = ? AND user_id = ?
+    """, [(seen, int(group_id), int(user_id)) for (group_id, user_id), seen in pending.items()])
+    conn.commit()
+    for group_id in {group_id for group_id, _ in pending}:
+        with _index_lock:
+            loaded = group_id in _group_language_counts
+        if loaded:
+            _load_counts(group_id, replace=True)
+    metrics.increment("member_activity_writes_total", len(pending))
+    return len(pending)
+
+def remove_member(group_id: str, user_id: str):
+    """
+    Removes a member who left or was banned from a group, so their language is no longer translated
+    unless another member reads it.
+    Args:
+        group_id (str): Telegram group identifier.
+        user_id (str): Telegram user identifier.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        DELETE FROM group_users WHERE group_id = ? AND user_id = ?
+    """, (int(group_id), int(user_id)))
+    conn.commit()
+    if cursor.rowcount:
+        metrics.increment("members_removed_total", reason="left")
+    with _index_lock:
+        _pending_activity.pop((group_id, user_id), None)
+        _group_members.get(group_id, {}).pop(user_id, None)
+    _load_counts(group_id, replace=True)
+
+def compact_members() -> int:
+    """
+    Removes members not seen for MEMBER_RETENTION_DAYS and reloads the counts of the groups involved.
+    Returns:
+        int: Number of members removed.
+    """
+    # Recent activity must be written first, or members seen since the last flush would be removed
+    flush_activity()
+    cutoff = time.time() - MEMBER_RETENTION_DAYS * 86400
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT group_id FROM group_users WHERE last_seen < ?", (cutoff,))
+    group_ids = [str(row["group_id"]) for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM group_users WHERE last_seen < ?", (cutoff,))
+    removed = cursor.rowcount
+    conn.commit()
+    for group_id in group_ids:
+        with _index_lock:
+            _group_members.pop(group_id, None)
+        _load_counts(group_id, replace=True)
+    if removed:
+        metrics.increment("members_removed_total", removed, reason="stale")
+        logging.info(f"Removed {removed} members not seen for {MEMBER_RETENTION_DAYS:g} days from {len(group_ids)} groups")
+    return removed
+
+async def maintain_members():
+    """
+    Writes recorded member activity every MEMBER_ACTIVITY_FLUSH_SECONDS and removes stale members
+    every MEMBER_COMPACTION_INTERVAL, starting at startup. Runs until cancelled.
+    """
+    next_compaction = time.monotonic()
+    while True:
+        try:
+            if MEMBER_RETENTION_DAYS > 0 and time.monotonic() >= next_compaction:
+                next_compaction = time.monotonic() + MEMBER_COMPACTION_INTERVAL
+                await run_db(compact_members)
+            else:
+                await run_db(flush_activity)
+        except Exception:
+            logging.exception("Member maintenance failed")
+        await asyncio.sleep(MEMBER_ACTIVITY_FLUSH_SECONDS)